@@ -0,0 +1,80 @@
+"""
+Parse cost of the provider scrapers over the HTML fixtures in benchmarks/fixtures.
+
+The fixtures are synthetic pages with the markup of the providers, a saved page of the
+provider can replace any of them keeping its name. Run from the repository root:
+
+    python -m benchmarks.parse_benchmark [--repeat N] [--baseline]
+
+--baseline also times the previous BeautifulSoup html.parser implementation.
+"""
+import argparse
+import ast
+import os
+import re
+import timeit
+
+from lib.ConcreteMangas.InManga import InManga
+from lib.ConcreteMangas.LectorManga import LectorManga
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+def fixture(name, binary=True):
+    with open(os.path.join(FIXTURES_DIR, name), 'rb' if binary else 'r', encoding=None if binary else 'utf-8') as file:
+        return file.read()
+
+def lectormanga_chapters_baseline(content):
+    from bs4 import BeautifulSoup
+    chapters = {}
+    chapter_bea = BeautifulSoup(content, 'html.parser').find_all(name="h4", attrs={"class" : "mt-2 text-truncate"}, href=False, recursive=True)
+    list_bea = BeautifulSoup(content, 'html.parser').find_all(name="ul", attrs={"class" : "list-group list-group-flush chapter-list"}, href=False, recursive=True)
+    for i, chapter in enumerate(chapter_bea):
+        chapter_div = str(list_bea[i].contents[1].contents[1].contents[9])
+        path = BeautifulSoup(chapter_div, 'html.parser').find(name="a", attrs={"class" : "btn btn-default btn-sm"}, href=True, recursive=True).get('href')
+        chapter_num = re.findall(r"[-+]?[.]?[\d]+(?:,\d\d\d)*[\.]?\d*(?:[eE][-+]?\d+)?", chapter.next)
+        chapters[float(chapter_num[0])] = path
+    return chapters
+
+def lectormanga_pages_baseline(content):
+    from bs4 import BeautifulSoup
+    url_1_bea = BeautifulSoup(content, 'html.parser')
+    date = re.search("var dirPath = '(.*)';", str(url_1_bea)).group(1).split("/")[-3]
+    id = re.search("var dirPath = '(.*)';", str(url_1_bea)).group(1).split("/")[-2]
+    pages = ast.literal_eval(re.search("var images = JSON.parse(.*);", str(url_1_bea)).group(1).replace('(\'', '').replace('\')', ''))
+    return date, id, pages
+
+def inmanga_pages_baseline(content):
+    from bs4 import BeautifulSoup
+    pages = BeautifulSoup(content, 'html.parser').find(id='PageList').find_all(True, recursive=False)
+    return [(int(page.get_text()), page.get('value')) for page in pages]
+
+def cases(baseline):
+    lectormanga_search = fixture('lectormanga_search.html')
+    lectormanga_chapters = fixture('lectormanga_chapters.html')
+    lectormanga_viewer = fixture('lectormanga_viewer.html', binary=False)
+    inmanga_search = fixture('inmanga_search.html')
+    inmanga_pages = fixture('inmanga_pages.html')
+    yield 'LectorManga search', lambda: LectorManga.parse_search(lectormanga_search)
+    yield 'LectorManga chapter list', lambda: LectorManga.parse_chapters(lectormanga_chapters)
+    if baseline:
+        yield 'LectorManga chapter list (baseline)', lambda: lectormanga_chapters_baseline(lectormanga_chapters)
+    yield 'LectorManga pages', lambda: LectorManga.parse_pages(lectormanga_viewer)
+    if baseline:
+        yield 'LectorManga pages (baseline)', lambda: lectormanga_pages_baseline(lectormanga_viewer)
+    yield 'InManga search', lambda: InManga.parse_search(inmanga_search)
+    yield 'InManga pages', lambda: InManga.parse_pages(inmanga_pages)
+    if baseline:
+        yield 'InManga pages (baseline)', lambda: inmanga_pages_baseline(inmanga_pages)
+
+def main():
+    parser = argparse.ArgumentParser(description='Parse cost of the provider scrapers')
+    parser.add_argument('--repeat', type=int, default=20, help='Parses timed for every fixture [Default = 20]')
+    parser.add_argument('--baseline', action='store_true', help='Also time the previous BeautifulSoup implementation')
+    args = parser.parse_args()
+    for name, parse in cases(args.baseline):
+        parse() # warm up
+        best = min(timeit.repeat(parse, number=1, repeat=args.repeat))
+        print(f'{name:<40} {best * 1000:9.3f} ms')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""
+Local stand-in for the providers: replays the recorded responses in benchmarks/fixtures
+(search results, chapter lists and chapter viewers) and serves synthetic page images,
+optionally adding latency, limiting bandwidth and injecting errors.
+
+    python -m benchmarks.replay_server [--port 8000] [--latency 50] [--bandwidth 2048] [--error-rate 0.05]
+
+use_replay(base_url) points the provider modules at a running server.
+"""
+import argparse
+import random
+import re
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from benchmarks.parse_benchmark import fixture
+
+PAGE_SIZE = 256 * 1024 # bytes of every synthetic page
+MIRRORS = ['/uploads', '/mirror/uploads'] # LectorManga image mirrors, at least two so pages fail over between them
+PROVIDER_HOSTS = ['https://inmanga.com', 'https://lectormanga.com'] + [f'https://img1.{domain}.com' for domain in ['recipeski', 'chefac', 'fashioncomplements', 'recipesandcooker']]
+
+def synthetic_png(size, seed=0):
+    """Valid grayscale png of about size bytes, noise does not compress"""
+    width = 1024
+    height = max(1, size // width)
+    noise = random.Random(seed)
+    raw = b''.join(b'\x00' + bytes(noise.getrandbits(8) for _ in range(width)) for _ in range(height))
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)) + chunk(b'IDAT', zlib.compress(raw, 1)) + chunk(b'IEND', b'')
+
+class ReplayServer:
+    """
+    Every request waits latency seconds before answering, bodies are sent at most at bandwidth
+    bytes per second per connection, error_rate of the requests get a 503 and drop_rate of the
+    bodies are cut in the middle.
+    """
+    # (method, path pattern, fixture or None for a page image, content type)
+    ROUTES = [
+        ('POST', r'/manga/getMangasConsultResult', 'inmanga_search.html', 'text/html; charset=utf-8'),
+        ('GET', r'/chapter/getall', 'inmanga_chapters.json', 'application/json'),
+        ('GET', r'/chapter/chapterIndexControls', 'inmanga_pages.html', 'text/html; charset=utf-8'),
+        ('GET', r'/page/getPageImage/', None, 'image/png'),
+        ('GET', r'/library$', 'lectormanga_search.html', 'text/html; charset=utf-8'),
+        ('GET', r'/library/manga/', 'lectormanga_chapters.html', 'text/html; charset=utf-8'),
+        ('GET', r'/view_uploads/', 'lectormanga_viewer.html', 'text/html; charset=utf-8'),
+        ('GET', r'(/mirror)?/uploads/.+', None, 'image/png'),
+        ('HEAD', r'(/mirror)?/uploads', None, 'image/png'),
+    ]
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, bandwidth=None, error_rate=0.0, drop_rate=0.0, page_size=PAGE_SIZE, seed=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.page = synthetic_png(page_size)
+        self.requests = 0
+        self.errors = 0
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+        self.base_url = f'http://{host}:{self.server.server_address[1]}'
+        self.bodies = {}
+        for _, _, name, _ in self.ROUTES:
+            if name and name not in self.bodies:
+                self.bodies[name] = self.rewrite(fixture(name))
+        self.thread = None
+
+    def rewrite(self, body):
+        """Links to the providers point to this server"""
+        for host in PROVIDER_HOSTS:
+            body = body.replace(host.encode(), self.base_url.encode())
+        return body
+
+    def chance(self, rate):
+        with self.random_lock:
+            return rate > 0 and self.random.random() < rate
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def handler(self):
+        replay = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1' # keep-alive, like the providers
+
+            def do_GET(self):
+                self.reply('GET')
+
+            def do_POST(self):
+                self.reply('POST')
+
+            def do_HEAD(self):
+                self.reply('HEAD')
+
+            def reply(self, method):
+                self.rfile.read(int(self.headers.get('Content-Length', 0))) # searches send a form even with GET
+                with replay.random_lock:
+                    replay.requests += 1
+                if replay.latency:
+                    time.sleep(replay.latency)
+                path = urlparse(self.path).path
+                route = next((route for route in replay.ROUTES if route[0] == method and re.match(route[1], path)), None)
+                if route is None:
+                    return self.send_body(404, b'', 'text/plain')
+                if replay.chance(replay.error_rate):
+                    with replay.random_lock:
+                        replay.errors += 1
+                    return self.send_body(503, b'', 'text/plain', {'Retry-After': '0'})
+                _, _, name, content_type = route
+                body = replay.bodies[name] if name else replay.page
+                start = 0
+                match = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+                if match and name is None: # resumed page
+                    start = int(match.group(1))
+                    if start >= len(body):
+                        return self.send_body(416, b'', 'text/plain')
+                    headers = {'Content-Range': f'bytes {start}-{len(body) - 1}/{len(body)}'}
+                    return self.send_body(206, body[start:], content_type, headers, head=method == 'HEAD')
+                self.send_body(200, body, content_type, head=method == 'HEAD')
+
+            def send_body(self, status, body, content_type, headers=None, head=False):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                if head or not body:
+                    return
+                if replay.chance(replay.drop_rate):
+                    with replay.random_lock:
+                        replay.errors += 1
+                    self.wfile.write(body[:len(body) // 2])
+                    self.close_connection = True
+                    return
+                chunk_size = 64 * 1024
+                for offset in range(0, len(body), chunk_size):
+                    chunk = body[offset:offset + chunk_size]
+                    self.wfile.write(chunk)
+                    if replay.bandwidth:
+                        time.sleep(len(chunk) / replay.bandwidth)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+def use_replay(base_url):
+    """Point the url constants of the provider modules, and the LectorManga image mirrors, to base_url"""
+    import lib.ConcreteMangas.InManga as inmanga
+    import lib.ConcreteMangas.LectorManga as lectormanga
+    from lib.MirrorSelector import MirrorSelector
+    for module in (inmanga, lectormanga):
+        for name, value in list(vars(module).items()):
+            if name.isupper() and isinstance(value, str):
+                for host in PROVIDER_HOSTS:
+                    if value.startswith(host):
+                        setattr(module, name, base_url + value[len(host):])
+    host = urlparse(base_url).netloc
+    inmanga.InManga.IMAGE_HOSTS = [host]
+    lectormanga.LectorManga.IMAGE_HOSTS = [host]
+    lectormanga.LectorManga.MIRRORS = MirrorSelector([base_url + mirror for mirror in MIRRORS])
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay the recorded provider responses')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0, help='Milliseconds before every response')
+    parser.add_argument('--bandwidth', type=float, help='KiB per second of every connection [Default = unlimited]')
+    parser.add_argument('--error-rate', type=float, default=0, help='Fraction of requests answered with 503')
+    parser.add_argument('--drop-rate', type=float, default=0, help='Fraction of bodies cut in the middle')
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE // 1024, help=f'KiB of every page image [Default = {PAGE_SIZE // 1024}]')
+    args = parser.parse_args()
+    server = ReplayServer(port=args.port, latency=args.latency / 1000, bandwidth=args.bandwidth * 1024 if args.bandwidth else None,
+                          error_rate=args.error_rate, drop_rate=args.drop_rate, page_size=args.page_size * 1024)
+    print(f'Replaying providers on {server.base_url}')
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == '__main__':
+    main()
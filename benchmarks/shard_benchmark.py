@@ -0,0 +1,87 @@
+"""
+Download time of --shard with 1..N worker processes against the replay server, without network.
+Every worker is a separate process, like the workers of other hosts sharing the manga directory.
+Run from the repository root:
+
+    python -m benchmarks.shard_benchmark [--workers 1,2,4] [--provider inmanga] [--chapters 1..6] [--bandwidth 1024]
+
+Everything is written to a temporary working directory, removed at the end.
+"""
+import argparse
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.replay_server import PAGE_SIZE, ReplayServer, use_replay
+
+TITLE = 'Manga Title 1'
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run_worker(base_url, argv):
+    """Worker process: the manga.py --worker loop with the providers pointed to the replay server"""
+    use_replay(base_url)
+    import manga
+    from lib.AbstractMangas.OnlineMangaTemplate import OnlineMangaTemplate
+    from lib.ArgsSingleService import ArgsSingleService
+    OnlineMangaTemplate.BLOB_STORE.enabled = False # every chapter of the fixtures has the same page urls, they would be linked instead of downloaded
+    sys.argv = ['manga.py', '--worker'] + argv
+    args = ArgsSingleService().args = manga.set_args('version')
+    manga.shard_worker(args)
+
+def spawn(base_url, argv, verbose):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    output = None if verbose else subprocess.DEVNULL
+    return lambda n: subprocess.Popen([sys.executable, '-m', 'benchmarks.shard_benchmark', '--as-worker', base_url, '--'] + argv, env=env, stdout=output, stderr=output)
+
+def run_shard(manga, provider, workers, base_url, argv, worker_argv, verbose):
+    from lib.ArgsSingleService import ArgsSingleService
+    sys.argv = ['manga.py', TITLE, '--shard', '--format', 'PNG', '--local-workers', str(workers)] + argv
+    args = ArgsSingleService().args = manga.set_args('version')
+    output = sys.stdout if verbose else io.StringIO()
+    with contextlib.redirect_stdout(output):
+        services = manga.create_manga_service_and_search_online(TITLE, {}, [provider])
+        service = manga.batch_selection({ 'title': TITLE }, services)
+        start = time.monotonic()
+        chapters = manga.shard(service, args, spawn(base_url, worker_argv, verbose))
+        return len(chapters), time.monotonic() - start
+
+def main():
+    parser = argparse.ArgumentParser(description='Download time of --shard with several worker processes')
+    parser.add_argument('--workers', default='1,2,4', help='Worker processes of every run, comma separated [Default = 1,2,4]')
+    parser.add_argument('--provider', default='inmanga', help='Provider of the series [Default = inmanga]')
+    parser.add_argument('--chapters', default='1..6', help='Chapters downloaded in every run [Default = 1..6]')
+    parser.add_argument('--threads', type=int, help='Pages downloaded at the same time by every worker [Default = manga.py default]')
+    parser.add_argument('--latency', type=float, default=20, help='Milliseconds before every response [Default = 20]')
+    parser.add_argument('--bandwidth', type=float, default=1024, help='KiB per second of every connection [Default = 1024]')
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE // 1024, help=f'KiB of every page image [Default = {PAGE_SIZE // 1024}]')
+    parser.add_argument('--verbose', action='store_true', help='Show the output of the coordinator and the workers')
+    parser.add_argument('--as-worker', metavar='BASE_URL', help=argparse.SUPPRESS)
+    args, worker_argv = parser.parse_known_args()
+    if args.as_worker:
+        return run_worker(args.as_worker, [arg for arg in worker_argv if arg != '--'])
+
+    argv = ['--chapters', args.chapters]
+    worker_argv = ['--threads', str(args.threads)] if args.threads else []
+    import manga # before changing the working directory, it is the import path
+    server = ReplayServer(latency=args.latency / 1000, bandwidth=args.bandwidth * 1024 if args.bandwidth else None, page_size=args.page_size * 1024)
+    use_replay(server.base_url)
+    cwd = os.getcwd()
+    baseline = None
+    with server:
+        for workers in [int(workers) for workers in args.workers.split(',')]:
+            with tempfile.TemporaryDirectory() as workdir:
+                os.chdir(workdir) # the library and the work queue are relative to the working directory
+                try:
+                    chapters, elapsed = run_shard(manga, args.provider, workers, server.base_url, argv, worker_argv, args.verbose)
+                finally:
+                    os.chdir(cwd)
+            baseline = baseline or elapsed
+            print(f'{workers:>3} worker{"s" if workers != 1 else " "} {chapters} chapters in {elapsed:6.2f}s  {chapters / elapsed:6.2f} chapters/s  x{baseline / elapsed:.2f}')
+    print(f'{server.requests} requests')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Throughput of manga.py against the replay server, without network: search latency (cold and
+cached), and for the downloaded chapters pages/s, MB/s and seconds per chapter end to end.
+Every provider is measured once per format: PNG only downloads, the others also convert, and the
+difference is the cost of the conversion. Run from the repository root:
+
+    python -m benchmarks.throughput_benchmark [--provider lectormanga] [--formats PNG,PDF] [--chapters 1..3] [--latency 50] [--bandwidth 2048] [--json results.json]
+
+Every run is written to its own temporary working directory, removed at the end.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.replay_server import PAGE_SIZE, ReplayServer, use_replay
+from lib.ProviderRegistry import PROVIDERS
+
+TITLE = 'Manga Title 1'
+
+def run_provider(manga, provider, format, argv, quiet):
+    from lib.AbstractMangas.OnlineMangaTemplate import OnlineMangaTemplate
+    from lib.ArgsSingleService import ArgsSingleService
+    from lib.BlobStore import BlobStore
+    OnlineMangaTemplate.BLOB_STORE = BlobStore() # its index stays open in the working directory of the previous run
+    sys.argv = ['manga.py', TITLE, '--format', format] + argv
+    args = ArgsSingleService().args = manga.set_args('version')
+    instances = {}
+    output = io.StringIO() if quiet else sys.stdout
+    result = { 'provider': provider, 'format': format }
+    with contextlib.redirect_stdout(output):
+        try:
+            for search in ('search_cold', 'search_cached'):
+                start = time.monotonic()
+                services = manga.create_manga_service_and_search_online(TITLE, instances, [provider])
+                result[search] = time.monotonic() - start
+            service = manga.batch_selection({ 'title': TITLE }, services)
+            start = time.monotonic()
+            chapters = manga.download_and_convert(service, args)
+            elapsed = time.monotonic() - start
+        except SystemExit: # network and conversion errors exit
+            result['status'] = 'FAILED'
+            return result
+    result.update({
+        'status': 'OK',
+        'chapters': len(chapters),
+        'pages': service.downloaded_pages,
+        'mb': service.downloaded_bytes / (1024 * 1024),
+        'seconds': elapsed,
+        'pages_per_second': service.downloaded_pages / elapsed,
+        'mb_per_second': service.downloaded_bytes / (1024 * 1024) / elapsed,
+        'seconds_per_chapter': elapsed / max(1, len(chapters)),
+    })
+    return result
+
+def report(result):
+    if result['status'] != 'OK':
+        print(f"{result['provider']:<12} {result['format']:<5} FAILED")
+        return
+    print(f"{result['provider']:<12} {result['format']:<5} search {result['search_cold'] * 1000:8.1f} ms (cached {result['search_cached'] * 1000:6.1f} ms)  "
+          f"{result['chapters']} chapters, {result['pages']} pages, {result['mb']:.1f} MB in {result['seconds']:.2f}s  "
+          f"{result['pages_per_second']:7.1f} pages/s {result['mb_per_second']:7.2f} MB/s {result['seconds_per_chapter']:6.2f} s/chapter")
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput of manga.py against the replay server')
+    parser.add_argument('--provider', action='append', help='Provider to measure, can be repeated [Default = all]')
+    parser.add_argument('--formats', default='PNG,PDF', help='Formats of the runs of every provider, comma separated [Default = PNG,PDF]')
+    parser.add_argument('--chapters', default='1..3', help='Chapters downloaded from every provider [Default = 1..3]')
+    parser.add_argument('--threads', type=int, help='Pages downloaded at the same time [Default = manga.py default]')
+    parser.add_argument('--latency', type=float, default=0, help='Milliseconds before every response')
+    parser.add_argument('--bandwidth', type=float, help='KiB per second of every connection [Default = unlimited]')
+    parser.add_argument('--error-rate', type=float, default=0, help='Fraction of requests answered with 503')
+    parser.add_argument('--drop-rate', type=float, default=0, help='Fraction of bodies cut in the middle')
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE // 1024, help=f'KiB of every page image [Default = {PAGE_SIZE // 1024}]')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the injected errors')
+    parser.add_argument('--json', help='Also write the results to this file')
+    parser.add_argument('--verbose', action='store_true', help='Show the output of manga.py')
+    args = parser.parse_args()
+
+    argv = ['--chapters', args.chapters] + (['--threads', str(args.threads)] if args.threads else [])
+    json_path = os.path.abspath(args.json) if args.json else None
+    import manga # before changing the working directory, it is the import path
+    providers = args.provider or list(PROVIDERS)
+    server = ReplayServer(latency=args.latency / 1000, bandwidth=args.bandwidth * 1024 if args.bandwidth else None,
+                          error_rate=args.error_rate, drop_rate=args.drop_rate, page_size=args.page_size * 1024, seed=args.seed)
+    use_replay(server.base_url)
+    results = []
+    cwd = os.getcwd()
+    with server:
+        for provider in providers:
+            for format in args.formats.split(','):
+                with tempfile.TemporaryDirectory() as workdir:
+                    os.chdir(workdir) # the library and the caches are relative to the working directory, every run starts cold
+                    try:
+                        result = run_provider(manga, provider, format.strip(), argv, not args.verbose)
+                    finally:
+                        os.chdir(cwd)
+                results.append(result)
+                report(result)
+    print(f'{server.requests} requests, {server.errors} injected errors')
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == '__main__':
+    main()
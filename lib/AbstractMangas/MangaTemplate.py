@@ -2,6 +2,7 @@
 from abc import ABC, abstractmethod
 from typing import Dict, List
 from lib.Common import not_found, print_colored
+from lib.Metrics import METRICS
 from lib.results.manga_class import Chapter, Manga, Page
 from colorama import Fore, Style, init as init_console_colors
 
@@ -11,11 +12,16 @@ class MangaTemplate(ABC):
         self.search_results = []
         self.current_manga = Manga()
         
+    def reset(self):
+        self.search_results = []
+        self.current_manga = Manga()
+
     def base_search(self, title) -> List[Manga]:
         if self.search_results:
             return self.search_results
         print_colored(f"Searching '{title}' in '{self.name}'...", Style.BRIGHT)
-        results = self.search(title)
+        with METRICS.timer('stage_seconds', stage='search', provider=self.name):
+            results = self.search(title)
         if not results: not_found(title)
         print_colored(f"Found {len(results)} results.", Style.BRIGHT)
     
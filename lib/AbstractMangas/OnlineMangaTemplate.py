@@ -1,49 +1,344 @@
 
 from abc import ABC, abstractmethod
+import hashlib
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from re import search
 from typing import Dict, List
+from urllib.parse import urlparse
 from colorama import Fore
-from lib.Common import encode_path, exit_if_fails, network_error, print_colored, success, write_file
+from lib.ArgsSingleService import ArgsSingleService
+from lib.Common import ErrorExit, encode_path, exit_if_fails, network_error, print_colored, success, write_stream
+from lib.Constants import DOWNLOAD_CHUNK_SIZE, DOWNLOAD_THREADS, HOST_CONNECTIONS, POOL_SIZE, REQUEST_RETRIES, REQUEST_TIMEOUT, RETRY_STATUS
 from lib.AbstractMangas.MangaTemplate import MangaTemplate
+from lib.PageManifest import PageManifest, file_hash, update_hash
+from lib.BlobStore import BlobStore
+from lib.Http2Transport import Http2Transport
+from lib.Metrics import METRICS
+from lib.SessionPool import SessionPool
+from lib.RateLimiter import CircuitBreaker, TokenBucket, backoff, retry_after
+from lib.ResponseCache import ResponseCache
 from lib.results.manga_class import Chapter, Manga, Page
 import cloudscraper
+import cloudscraper.exceptions
 import requests
 
 class OnlineMangaTemplate(MangaTemplate, ABC):
+    HOST_SEMAPHORES = {}
+    HOST_SEMAPHORES_LOCK = threading.Lock()
+    HOST_LIMITERS = {}
+    CIRCUIT_BREAKERS = {}
+    RESPONSE_CACHE = ResponseCache()
+    BLOB_STORE = BlobStore()
+    IMAGE_HOSTS = []
+    SCRAPER_OPTIONS = { 'browser': 'chrome', 'allow_brotli': False, 'debug': False }
+    RENEW_SCRAPER_OPTIONS = {
+        'delay': 10,
+        'browser': {
+            'browser': 'chrome',
+            'platform': 'android',
+            'desktop': False
+        },
+        'captcha': { 'provider': '2captcha' }
+    }
+
     def __init__(self):
         super().__init__()
-        self.SCRAPER = cloudscraper.create_scraper(browser = 'chrome', allow_brotli = False, debug = False)
+        self.downloaded_pages = 0
+        self.downloaded_lock = threading.Lock()
+        self.downloaded_bytes = 0
+        self.cancelled = None # pages are not downloaded once it returns True
+
+    @property
+    def SCRAPER(self):
+        # shared by every instance of the provider and kept between runs
+        return SessionPool.get(self.name, self.pool_sizes(), **self.SCRAPER_OPTIONS)
         
-    def renew_scrapper(self):
-        self.SCRAPER = cloudscraper.create_scraper(delay=10,
-                                    browser={
-                                            'browser': 'chrome',
-                                            'platform': 'android',
-                                            'desktop': False
-                                            },
-                                    captcha={'provider': '2captcha'})
+    def renew_scrapper(self, stale_scraper=None):
+        return SessionPool.renew(self.name, stale_scraper, self.pool_sizes(), **self.RENEW_SCRAPER_OPTIONS)
+
+    def pool_sizes(self):
+        """Connections kept alive for every host serving pages"""
+        pool_size = getattr(ArgsSingleService().args, 'pool_size', None) or POOL_SIZE
+        return { host: pool_size for host in self.IMAGE_HOSTS }
+
+    def page_transport(self):
+        if not getattr(ArgsSingleService().args, 'http2', False):
+            return None
+        pool_size = getattr(ArgsSingleService().args, 'pool_size', None) or POOL_SIZE
+        return Http2Transport.get(self.name, self.SCRAPER, pool_size)
+
+    @staticmethod
+    def is_challenge(response):
+        return response.status_code in (403, 503) and response.headers.get('Server', '').lower() == 'cloudflare'
 
 
     def download(self, filename, url, directory='.', extension='png', text='', ok=200, headers=None):
+        manifest = PageManifest(directory)
+        with METRICS.timer('stage_seconds', stage='download', provider=self.name):
+            page = self.fetch_page(filename, url, directory, extension, ok, headers, manifest)
+        downloaded = self.report_download(page, text)
+        manifest.save()
+        return downloaded
+
+    def download_pages(self, pages, directory='.', extension='png', ok=200, headers=None, mirrors=None):
+        """Download (page_number, url) pages concurrently, printing progress in page order. With mirrors urls are relative to them."""
+        total = len(pages)
+        threads = max(1, getattr(ArgsSingleService().args, 'threads', DOWNLOAD_THREADS))
+        manifest = PageManifest(directory)
+        manifest.set_total(total)
+        downloaded = 0
+        with METRICS.timer('stage_seconds', stage='download', provider=self.name), ThreadPoolExecutor(max_workers=threads) as executor:
+            fetch_page = ArgsSingleService.inherit(self.fetch_page) # the arguments of the job (--serve)
+            futures = [executor.submit(fetch_page, page_number, url, directory, extension, ok, headers, manifest, mirrors) for page_number, url in pages]
+            try:
+                for (page_number, _), future in zip(pages, futures):
+                    text = f'Page {page_number}/{total} ({100*page_number//total}%)'
+                    if self.report_download(future.result(), text):
+                        downloaded += 1
+                    manifest.save()
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+        return downloaded
+
+    def chapter_downloaded(self, chapter_dir):
+        if PageManifest(chapter_dir).is_complete():
+            print_colored(f'{chapter_dir} - Already downloaded', Fore.YELLOW)
+            return True
+        return False
+
+    def fetch_page(self, filename, url, directory='.', extension='png', ok=200, headers=None, manifest=None, mirrors=None):
+        if self.cancelled is not None and self.cancelled():
+            raise ErrorExit('Cancelled')
         path = encode_path(filename, extension, directory)
-        if os.path.isfile(path):
+        page_file = os.path.basename(path)
+        manifest = manifest if manifest is not None else PageManifest(directory)
+        if manifest.has(page_file):
+            if manifest.verify(page_file): # resumed chapter, the page is reused only if its content is intact
+                return path, None, ok
+            print_colored(f'{path} - Corrupted, downloading again', Fore.YELLOW)
+            self.BLOB_STORE.discard(manifest.pages[page_file]['sha256']) # the blob it links is corrupted too
+            manifest.discard(page_file)
+            os.remove(path)
+        if os.path.isfile(path): # downloaded before the chapter had a manifest
+            sha256 = file_hash(path)
+            manifest.add(page_file, os.path.getsize(path), sha256)
+            self.BLOB_STORE.store(path, sha256)
+            return path, None, ok
+        store_key = f'{self.name}:{url}' # relative to the mirrors when there are mirrors
+        known = self.BLOB_STORE.lookup(store_key)
+        if known is not None and self.BLOB_STORE.link(known[0], path): # downloaded before for another chapter or series
+            manifest.add(page_file, known[1], known[0])
+            METRICS.count('dedup_total', provider=self.name, result='known_url')
+            return path, None, ok
+        part_path = f'{path}.part'
+        started = time.monotonic()
+        # with mirrors the url is a path relative to them, and a failing mirror is replaced by the next fastest one
+        tried = []
+        mirror = mirrors.best() if mirrors is not None else None
+        while True:
+            page_url = mirror.url(url) if mirror is not None else url
+            start = time.monotonic()
+            try:
+                failover = mirror is not None and len(tried) + 1 < len(mirrors.mirrors) # the last mirror is retried as usual
+                req, expected, offset, sha256 = self.stream_page(page_url, part_path, headers, ok, failover=failover)
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError):
+                req, expected = None, ok
+            downloaded = req is not None and req.status_code == expected
+            if mirror is None:
+                break
+            mirrors.record(mirror, downloaded, time.monotonic() - start)
+            tried.append(mirror)
+            if downloaded:
+                break
+            mirror = mirrors.best(exclude=tried)
+            if mirror is None:
+                if req is None:
+                    network_error()
+                break
+        if not downloaded:
+            return path, req, expected
+        os.replace(part_path, path)
+        size = os.path.getsize(path)
+        manifest.add(page_file, size, sha256.hexdigest())
+        if self.BLOB_STORE.store(path, sha256.hexdigest()):
+            METRICS.count('dedup_total', provider=self.name, result='same_content')
+        self.BLOB_STORE.remember(store_key, sha256.hexdigest(), size)
+        with self.downloaded_lock:
+            self.downloaded_pages += 1
+            self.downloaded_bytes += size - offset
+        METRICS.count('pages_total', provider=self.name)
+        METRICS.count('bytes_total', size - offset, provider=self.name)
+        METRICS.observe('page_seconds', time.monotonic() - started, provider=self.name)
+        return path, req, expected
+
+    def stream_page(self, url, part_path, headers=None, ok=200, failover=False):
+        """
+        Stream a page into part_path, resuming it with a Range request if a previous attempt or run was interrupted.
+        Returns the response, its expected status, the resumed offset and the hash of the whole file.
+        A lost connection is resumed with backoff, or raised at once to fail over to another mirror.
+        """
+        retries = 0 if failover else REQUEST_RETRIES
+        first_offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+        for attempt in range(retries + 1):
+            try:
+                req, ok, offset, sha256 = self.stream_page_once(url, part_path, headers, ok, failover)
+                return req, ok, min(first_offset, offset), sha256 # bytes already on disk before this run
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError):
+                if attempt == retries:
+                    if failover:
+                        raise
+                    network_error() # the partial file is kept and resumed in the next run
+                wait = backoff(attempt)
+                METRICS.count('retries_total', provider=self.name, reason='body')
+                print_colored(f'Connection lost downloading {url} - resuming in {wait:.0f}s', Fore.YELLOW)
+                time.sleep(wait)
+
+    def stream_page_once(self, url, part_path, headers=None, ok=200, failover=False):
+        offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+        if offset:
+            headers = {**(headers or {}), 'Range': f'bytes={offset}-'}
+        sha256 = hashlib.sha256()
+        # the body is streamed to disk in chunks, so memory does not depend on the image size
+        with self.host_semaphore(url):
+            req = self.scraper_get(url, headers=headers, stream=True, retries=0 if failover else REQUEST_RETRIES, raise_errors=failover)
+            try:
+                if offset and req.status_code == 206:
+                    ok = 206
+                    update_hash(sha256, part_path)
+                    write_stream(part_path, req.iter_content(chunk_size=self.chunk_size()), mode='ab', sha256=sha256)
+                elif req.status_code == ok:
+                    offset = 0
+                    write_stream(part_path, req.iter_content(chunk_size=self.chunk_size()), sha256=sha256)
+                elif offset and req.status_code == 416: # partial file cannot be resumed
+                    os.remove(part_path)
+            finally:
+                req.close()
+        return req, ok, offset, sha256
+
+    def chunk_size(self):
+        return max(1, getattr(ArgsSingleService().args, 'chunk_size', DOWNLOAD_CHUNK_SIZE // 1024)) * 1024
+
+    def report_download(self, fetched, text=''):
+        path, req, ok = fetched
+        if req is None:
             text = text if text else path
             separation = ' ' * (20 - len(text))
             print_colored(f'{text}{separation}- Already exists', Fore.YELLOW)
             return False
-        req = self.scraper_get(url, headers=headers)
-        if success(req, text, ok, print_ok=bool(text)):
-            data = req.content
-            write_file(path, data)
-            return True
-        return False
+        return success(req, text, ok, print_ok=bool(text))
+
+    def host_semaphore(self, url):
+        return OnlineMangaTemplate.shared(OnlineMangaTemplate.HOST_SEMAPHORES, urlparse(url).netloc, lambda: threading.BoundedSemaphore(HOST_CONNECTIONS))
+
+    def host_limiter(self, url):
+        return OnlineMangaTemplate.shared(OnlineMangaTemplate.HOST_LIMITERS, urlparse(url).netloc, TokenBucket)
+
+    def circuit_breaker(self):
+        return OnlineMangaTemplate.shared(OnlineMangaTemplate.CIRCUIT_BREAKERS, self.name, CircuitBreaker)
+
+    @staticmethod
+    def shared(registry, key, create):
+        """Per host or per provider object shared by every instance and thread"""
+        with OnlineMangaTemplate.HOST_SEMAPHORES_LOCK:
+            if key not in registry:
+                registry[key] = create()
+            return registry[key]
     
-    def scraper_get(self, url, headers=None, data=None):
-        try:
-            response = self.SCRAPER.get(url, headers=headers, data=data)
-        except requests.exceptions.ConnectionError:
-            network_error()
+    def scraper_get(self, url, headers=None, data=None, stream=False, retries=REQUEST_RETRIES, raise_errors=False):
+        return self.scraper_request('get', url, headers=headers, data=data, stream=stream, retries=retries, raise_errors=raise_errors)
+
+    def scraper_request(self, method, url, headers=None, data=None, stream=False, retries=REQUEST_RETRIES, raise_errors=False):
+        limiter = self.host_limiter(url)
+        breaker = self.circuit_breaker()
+        renewed = False
+        for attempt in range(retries + 1):
+            if breaker.remaining() > 0:
+                print_colored(f'{self.name} is failing, waiting {breaker.remaining():.0f}s before trying again...', Fore.YELLOW)
+                breaker.wait()
+            limiter.acquire()
+            transport = self.page_transport() if stream else None
+            scraper = transport or self.SCRAPER
+            start = time.monotonic()
+            try:
+                response = scraper.request(method, url, headers=headers, data=data, stream=stream, timeout=REQUEST_TIMEOUT)
+            except cloudscraper.exceptions.CloudflareException:
+                if renewed:
+                    raise
+                METRICS.count('retries_total', provider=self.name, reason='challenge')
+                self.renew_scrapper(scraper) # only when the challenge actually fails
+                renewed = True
+                continue
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError, requests.exceptions.Timeout): # bodies of metadata requests are read here
+                METRICS.count('requests_total', provider=self.name, status='error')
+                breaker.record(False)
+                if attempt == retries:
+                    if raise_errors:
+                        raise
+                    network_error()
+                wait = backoff(attempt)
+                METRICS.count('retries_total', provider=self.name, reason='connection')
+                print_colored(f'Connection error {url} - retrying in {wait:.0f}s', Fore.YELLOW)
+                time.sleep(wait)
+                continue
+            METRICS.observe('request_seconds', time.monotonic() - start, provider=self.name, host=urlparse(url).netloc)
+            METRICS.count('requests_total', provider=self.name, status=response.status_code)
+            if self.is_challenge(response) and transport is not None: # the cloudscraper session can solve it
+                METRICS.count('retries_total', provider=self.name, reason='challenge')
+                response.close()
+                Http2Transport.disable(self.name)
+                continue
+            if self.is_challenge(response) and not renewed and attempt < retries:
+                METRICS.count('retries_total', provider=self.name, reason='challenge')
+                response.close()
+                self.renew_scrapper(scraper)
+                renewed = True
+                continue
+            if response.status_code in RETRY_STATUS:
+                wait = retry_after(response)
+                if response.status_code in (429, 503): # also without retries, the host is slowed down before failing over to another mirror
+                    limiter.throttled(wait)
+                breaker.record(False)
+                if attempt == retries:
+                    return response
+                response.close()
+                wait = wait if wait is not None else backoff(attempt)
+                METRICS.count('retries_total', provider=self.name, reason=response.status_code)
+                print_colored(f'[{response.status_code}] {url} - retrying in {wait:.0f}s', Fore.YELLOW)
+                time.sleep(wait)
+                continue
+            breaker.record(response.status_code < 500)
+            limiter.succeeded()
+            if response.status_code < 400 and not stream: # challenges are solved on metadata requests, pages are saved at exit
+                SessionPool.save(self.name)
+            return response
+        # every attempt was spent renewing the session or falling back from HTTP/2
+        if raise_errors:
+            raise requests.exceptions.ConnectionError(f'No response from {url} after {retries + 1} attempts')
+        network_error()
+
+    def cached_request(self, method, url, ttl, headers=None, data=None):
+        """Request provider metadata (search, chapter listings) through the on-disk response cache"""
+        key = ResponseCache.key(self.name, method, url, data)
+        meta, cached = OnlineMangaTemplate.RESPONSE_CACHE.get(key)
+        refresh = getattr(ArgsSingleService().args, 'refresh', False)
+        if cached is not None and not refresh:
+            if ResponseCache.is_fresh(meta, ttl):
+                METRICS.count('cache_total', provider=self.name, result='hit')
+                return cached
+            headers = {**(headers or {}), **ResponseCache.validators(meta)}
+        response = self.scraper_request(method, url, headers=headers, data=data)
+        if cached is not None and not refresh and response.status_code == 304:
+            OnlineMangaTemplate.RESPONSE_CACHE.revalidated(key)
+            METRICS.count('cache_total', provider=self.name, result='revalidated')
+            return cached
+        METRICS.count('cache_total', provider=self.name, result='miss')
+        if response.status_code == 200:
+            OnlineMangaTemplate.RESPONSE_CACHE.put(key, response)
         return response
     
     @abstractmethod
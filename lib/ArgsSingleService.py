@@ -1,18 +1,58 @@
 import argparse
+import threading
+from contextlib import contextmanager
 
-from lib.Constants import CHAPTERS_FORMAT, MANGA_DIR, NAME, VERSION, WEBSITE
+from lib.Constants import CHAPTERS_FORMAT, CONVERT_WORKER_MEMORY, CONVERT_WORKERS, DOWNLOAD_CHUNK_SIZE, DOWNLOAD_THREADS, MANGA_DIR, NAME, POOL_SIZE, SERVICE_CONVERT_JOBS, SERVICE_DOWNLOAD_JOBS, SERVICE_PORT, VERSION, WEBSITE
 
 class ArgsSingleService(object):
   _shared_borg_state = {}
       
+  _thread = threading.local() # arguments of the job run by the current thread (--serve)
+      
   def __new__(cls, *args, **kwargs):
     obj = super(ArgsSingleService, cls).__new__(cls, *args, **kwargs)
     obj.__dict__ = cls._shared_borg_state
     return obj
 
+  @property
+  def args(self):
+    args = getattr(ArgsSingleService._thread, 'args', None)
+    if args is not None:
+      return args
+    try:
+      return self.__dict__['args']
+    except KeyError:
+      raise AttributeError('args')
+
+  @args.setter
+  def args(self, args):
+    self.__dict__['args'] = args
+
+  @staticmethod
+  @contextmanager
+  def thread_args(args):
+    """Arguments seen by the current thread only, other threads keep the process arguments"""
+    previous = getattr(ArgsSingleService._thread, 'args', None)
+    ArgsSingleService._thread.args = args
+    try:
+      yield args
+    finally:
+      ArgsSingleService._thread.args = previous
+
+  @staticmethod
+  def inherit(function):
+    """function running with the arguments of the current thread, for the threads it starts"""
+    args = getattr(ArgsSingleService._thread, 'args', None)
+    if args is None:
+      return function
+    def run(*function_args, **kwargs):
+      with ArgsSingleService.thread_args(args):
+        return function(*function_args, **kwargs)
+    return run
+
 def set_args(checkversion):
   parser = argparse.ArgumentParser(prog=NAME, epilog=f'web: {WEBSITE}')
-  parser.add_argument("manga", help="manga to download", nargs='+')
+  parser.add_argument("manga", help="manga to download", nargs='*')
   parser.add_argument("--chapters", "--chapter", help=f'chapters to download. {CHAPTERS_FORMAT} If this argument is not provided all chapters will be downloaded.', nargs='+')
   parser.add_argument("--directory", help=f"directory to save downloads. Default: {MANGA_DIR}", default=MANGA_DIR)
   parser.add_argument("--single", action='store_true', help="merge all chapters in only one file. If this argument is not provided every chapter will be in a different file")
@@ -20,8 +60,31 @@ def set_args(checkversion):
   parser.add_argument("--profile", help='Device profile (Available options: K1, K2, K34, K578, KDX, KPW, KV, KO, KoMT, KoG, KoGHD, KoA, KoAHD, KoAH2O, KoAO) [Default = KPW (Kindle Paperwhite)]', default='KPW')
   parser.add_argument("--format", help='Output format (Available options: PNG, PDF, MOBI, EPUB, CBZ) [Default = MOBI]. If PNG is selected then no conversion to e-reader file will be done', default='MOBI')
   parser.add_argument("--fullsize", action='store_true', help="Do not stretch images to the profile's device resolution")
+  parser.add_argument("--follow", action='store_true', help="Only download and convert the chapters that were not downloaded with --follow before")
+  parser.add_argument("--convert-workers", type=int, help=f"Number of chapters converted at the same time, every conversion uses all the CPUs for its images [Default = {CONVERT_WORKERS}]")
+  parser.add_argument("--convert-memory", type=int, help=f"Memory in MB available for conversions, every chapter conversion (KCC and its image processes) is expected to use {CONVERT_WORKER_MEMORY} MB [Default = available memory]")
   parser.add_argument("--cache", action='store_true', help="Avoid downloading chapters and use already downloaded chapters instead (offline)")
+  parser.add_argument("--pool-size", type=int, help=f"Connections kept alive for every host serving pages [Default = {POOL_SIZE}]", default=POOL_SIZE)
+  parser.add_argument("--http2", action='store_true', help='Download pages over HTTP/2, sharing one connection per host. Needs httpx: pip install "httpx[http2]"')
+  parser.add_argument("--chunk-size", type=int, help=f"Size in KiB of the chunks written to disk while downloading pages [Default = {DOWNLOAD_CHUNK_SIZE // 1024}]", default=DOWNLOAD_CHUNK_SIZE // 1024)
+  parser.add_argument("--refresh", action='store_true', help="Ignore cached search results and chapter listings and request them again to the providers")
   parser.add_argument("--remove-alpha", action='store_true', help="When converting to PDF remove alpha channel on images using ImageMagick Wand")
+  parser.add_argument("--threads", type=int, help=f"Number of pages downloaded at the same time [Default = {DOWNLOAD_THREADS}]", default=DOWNLOAD_THREADS)
+  parser.add_argument("--batch", metavar='WATCHLIST', help="JSON file with a list of series to process in this run without prompts. Every entry has a title and optionally provider, id, chapters, format, profile, single, rotate, fullsize, cache and follow")
+  parser.add_argument("--metrics-log", metavar='PATH', help="Append request, download and conversion metrics to this file as JSON lines")
+  parser.add_argument("--metrics-prom", metavar='PATH', help="Write the metrics of the run to this file in the Prometheus text format when it ends")
+  parser.add_argument("--metrics-port", type=int, help="Serve the metrics in the Prometheus text format on http://localhost:PORT/metrics while running")
+  parser.add_argument("--prune-blobs", action='store_true', help="Free the space of downloaded pages that are not part of any chapter anymore and exit")
+  parser.add_argument("--profile-startup", action='store_true', help="Show the time spent starting up and the slowest imports")
+  parser.add_argument("--serve", metavar='PORT', nargs='?', type=int, const=SERVICE_PORT, help=f"Run as a service processing the jobs submitted to http://localhost:PORT/jobs [Default port = {SERVICE_PORT}]")
+  parser.add_argument("--download-jobs", type=int, help=f"With --serve, series downloaded at the same time [Default = {SERVICE_DOWNLOAD_JOBS}]", default=SERVICE_DOWNLOAD_JOBS)
+  parser.add_argument("--convert-jobs", type=int, help=f"With --serve, series converted at the same time [Default = {SERVICE_CONVERT_JOBS}]", default=SERVICE_CONVERT_JOBS)
+  parser.add_argument("--shard", action='store_true', help="Queue the chapters in the manga directory and wait until the --worker processes of this or other hosts sharing it download them")
+  parser.add_argument("--local-workers", type=int, help="With --shard, worker processes started in this host [Default = 0, only other hosts]", default=0)
+  parser.add_argument("--worker", action='store_true', help="Download the chapters queued with --shard in the manga directory until there are none left")
   parser.add_argument("--version", "-v", action=checkversion, help="Display current InMangaKindle version", version=VERSION)
-  return parser.parse_args()
+  args = parser.parse_args()
+  if not args.manga and not args.batch and not args.prune_blobs and args.serve is None and not args.worker:
+    parser.error('the following arguments are required: manga')
+  return args
 
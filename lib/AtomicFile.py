@@ -0,0 +1,23 @@
+import os
+import socket
+import threading
+from contextlib import contextmanager
+
+@contextmanager
+def replace_file(path, mode='w'):
+    """
+    File to write a new version of path, which replaces it at once when the block ends without errors.
+    The temporary file is unique to this host, process and thread, so writers of the same path
+    (--shard workers, two runs searching the same title) never replace each other's temporary file.
+    """
+    temp_path = f'{path}.{socket.gethostname()}-{os.getpid()}-{threading.get_ident()}.tmp'
+    try:
+        with open(temp_path, mode) as f:
+            yield f
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,107 @@
+import os
+import sqlite3
+import threading
+
+from lib.Constants import BLOB_INDEX_FILE, BLOBS_DIR
+
+class BlobStore:
+    """
+    Content-addressed store of the downloaded pages (sha256 -> file) in the manga directory.
+    Chapter directories keep their layout but every page is a hardlink to its blob, so identical
+    pages (credits, scanlator banners, re-uploaded chapters) are stored once, and urls whose
+    content is already known are linked from the store instead of downloaded again.
+    Blobs are shared, so pages must be replaced (write a new file and os.replace) and never edited in place.
+    """
+    def __init__(self, directory=BLOBS_DIR, index_path=BLOB_INDEX_FILE):
+        self.directory = directory
+        self.index_path = index_path
+        self.lock = threading.Lock()
+        self.connection = None
+        self.enabled = True
+
+    def _index(self):
+        if self.connection is None: # opened on first use, the store is created at import time
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            self.connection = sqlite3.connect(self.index_path, check_same_thread=False)
+            with self.connection:
+                self.connection.execute('CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, sha256 TEXT, size INTEGER)')
+                self.connection.execute('CREATE INDEX IF NOT EXISTS urls_sha256 ON urls (sha256)')
+        return self.connection
+
+    def blob_path(self, sha256):
+        return f'{self.directory}/{sha256[:2]}/{sha256}'
+
+    def lookup(self, url):
+        """(sha256, size) of the content of the url, if it is still stored"""
+        with self.lock:
+            row = self._index().execute('SELECT sha256, size FROM urls WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return None
+        try:
+            return row if os.path.getsize(self.blob_path(row[0])) == row[1] else None
+        except OSError:
+            return None
+
+    def remember(self, url, sha256, size):
+        with self.lock, self._index() as connection:
+            connection.execute('INSERT OR REPLACE INTO urls VALUES (?, ?, ?)', (url, sha256, size))
+
+    def link(self, sha256, path):
+        """Replace path with a hardlink to the blob, False if it cannot be linked"""
+        if not self.enabled:
+            return False
+        link_path = f'{path}.link'
+        try:
+            if os.path.isfile(path) and os.path.samefile(self.blob_path(sha256), path): # renaming a link over the same file does nothing
+                return True
+            if os.path.lexists(link_path):
+                os.remove(link_path)
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            os.link(self.blob_path(sha256), link_path)
+            os.replace(link_path, path)
+            return True
+        except OSError:
+            return False
+
+    def store(self, path, sha256):
+        """Add the file to the store. Returns True when the content was already stored and path is now a link to it"""
+        if not self.enabled:
+            return False
+        blob = self.blob_path(sha256)
+        if os.path.isfile(blob):
+            return self.link(sha256, path)
+        try:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.link(path, blob)
+        except FileExistsError: # stored by another thread meanwhile
+            return self.link(sha256, path)
+        except OSError: # the file system does not support hardlinks, pages are stored as before
+            self.enabled = False
+        return False
+
+    def discard(self, sha256):
+        """Forget a corrupted blob, chapters linking it keep their copy until they are downloaded again"""
+        with self.lock, self._index() as connection:
+            connection.execute('DELETE FROM urls WHERE sha256 = ?', (sha256,))
+        try:
+            os.remove(self.blob_path(sha256))
+        except OSError:
+            pass
+
+    def prune(self):
+        """Remove the blobs no chapter links anymore, returns the bytes freed"""
+        freed = 0
+        if not os.path.isdir(self.directory):
+            return freed
+        for prefix in os.scandir(self.directory):
+            if not prefix.is_dir():
+                continue
+            for blob in os.scandir(prefix.path):
+                stat = blob.stat()
+                if stat.st_nlink == 1:
+                    os.remove(blob.path)
+                    freed += stat.st_size
+        with self.lock, self._index() as connection:
+            stored = connection.execute('SELECT DISTINCT sha256 FROM urls').fetchall()
+            connection.executemany('DELETE FROM urls WHERE sha256 = ?', [row for row in stored if not os.path.isfile(self.blob_path(row[0]))])
+        return freed
@@ -1,5 +1,6 @@
 
 import urllib.parse
+import atexit
 import bisect
 import math
 import re
@@ -7,13 +8,19 @@ import signal
 import json
 import sys
 from typing import List, Tuple
-from urllib import request
 from colorama import Fore, Style, init as init_console_colors
 import os
 import subprocess
 import platform
+import tempfile
+import threading
+import time
 from lib.ArgsSingleService import ArgsSingleService
 from lib.Constants import *
+from lib.BlobStore import BlobStore
+from lib.ConversionCache import ConversionCache
+from lib.Metrics import METRICS
+from lib.PageManifest import PageManifest, file_hash
 from lib.results.manga_class import Chapter
 
 def load_json(data, *keys):
@@ -60,41 +67,88 @@ def cancellable():
   except:
     pass
   
-def write_file(path, data):
+def write_file(path, data, mode='wb'):
     dirname = os.path.dirname(path)
     if not os.path.exists(dirname):
-        os.makedirs(dirname)
-    with open(path, 'wb') as handler:
+        os.makedirs(dirname, exist_ok=True) # pages may be written from several threads
+    with open(path, mode) as handler:
         handler.write(data)
 
+def write_stream(path, chunks, mode='wb', sha256=None):
+    dirname = os.path.dirname(path)
+    if not os.path.exists(dirname):
+        os.makedirs(dirname, exist_ok=True)
+    with open(path, mode) as handler:
+        for chunk in chunks:
+            handler.write(chunk)
+            if sha256 is not None:
+                sha256.update(chunk)
+
+def latest_version(use_cache=True):
+  """(tag, release url) of the latest version, the answer is cached for VERSION_CHECK_TTL"""
+  if use_cache:
+    try:
+      with open(VERSION_CHECK_FILE, 'r', encoding='utf-8') as f:
+        cached = json.load(f)
+      if time.time() - cached['checked'] < VERSION_CHECK_TTL:
+        return cached['tag_name'], cached['html_url']
+    except (OSError, ValueError, KeyError):
+      pass
+  from urllib import request
+  with request.urlopen(f'https://api.github.com/repos/Carleslc/{NAME}/releases/latest', timeout=VERSION_CHECK_TIMEOUT) as response:
+    content = response.read()
+  latest = load_json(content, 'tag_name'), load_json(content, 'html_url')
+  write_file(f'{VERSION_CHECK_FILE}.part', json.dumps({ 'checked': time.time(), 'tag_name': latest[0], 'html_url': latest[1] }).encode('utf-8'))
+  os.replace(f'{VERSION_CHECK_FILE}.part', VERSION_CHECK_FILE)
+  return latest
+
+def new_version_available(latest_version, html_url):
+  print_colored(f'New version is available! {VERSION} -> {latest_version}', Style.BRIGHT, Fore.GREEN)
+  print_colored(f'Upgrade to the latest version: {html_url}', Fore.GREEN)
+
 def check_version():
-  args = ArgsSingleService().args
-  latest_version = None
+  args = getattr(ArgsSingleService(), 'args', None)
+  latest = None
   try:
-    response = request.get(f'https://api.github.com/repos/Carleslc/{NAME}/releases/latest')
-    html_url = load_json(response.content, 'html_url')
-    latest_version = load_json(response.content, 'tag_name')
+    latest = latest_version(use_cache=False)
   except:
-    if not args.cache:
+    if not getattr(args, 'cache', False):
       print_dim(f'Cannot check for updates. Version: {VERSION}', Fore.YELLOW)
-  if latest_version is None:
+  if latest is None:
     return False
-  is_updated = latest_version == VERSION
+  latest_version_tag, html_url = latest
+  is_updated = latest_version_tag == VERSION
   if not is_updated:
-    print_colored(f'New version is available! {VERSION} -> {latest_version}', Style.BRIGHT, Fore.GREEN)
-    print_colored(f'Upgrade to the latest version: {html_url}', Fore.GREEN)
+    new_version_available(latest_version_tag, html_url)
     if os.path.isdir('.git'):
       print_colored('Git detected. Do you want to checkout the new version❓ [Y/n]', Fore.YELLOW, Style.BRIGHT, end=' ')
       try:
         answer = input()
         if not answer or answer.lower() == 'y':
           subprocess.check_call(['git', 'fetch', 'origin', 'master'])
-          subprocess.check_call(['git', 'checkout', latest_version])
+          subprocess.check_call(['git', 'checkout', latest_version_tag])
       except:
         print('If you want to update later manually use ', end='')
-        print_colored(f'git fetch && git checkout {latest_version}', Fore.YELLOW)
+        print_colored(f'git fetch && git checkout {latest_version_tag}', Fore.YELLOW)
   return is_updated
 
+def check_version_in_background():
+  """Checks for updates (cached for a day) while the program runs, a new version is reported when it ends"""
+  latest = []
+  def check():
+    try:
+      latest.append(latest_version())
+    except Exception: # offline, --version reports it
+      pass
+  def report():
+    if latest and latest[0][0] != VERSION:
+      latest_version_tag, html_url = latest[0]
+      new_version_available(latest_version_tag, html_url)
+      if os.path.isdir('.git'):
+        print_colored(f'git fetch && git checkout {latest_version_tag}', Fore.YELLOW)
+  threading.Thread(target=check, daemon=True).start()
+  atexit.register(report)
+
 def print_dim(s, *colors):
   print_colored(s, Style.DIM, *colors)
   
@@ -118,11 +172,17 @@ def network_error():
     tip += '\nYou can use offline mode (using your already downloaded chapters) with --cache'
   error('Network error', tip)
   
+class ErrorExit(SystemExit):
+  """Raised by error(), exits like exit() but keeps the message for the callers that go on (--batch, --serve)"""
+  def __init__(self, message=''):
+    super().__init__()
+    self.message = message
+
 def error(message, tip=''):
   print_colored(message, Fore.RED, Style.BRIGHT)
   if tip:
     print_dim(tip)
-  exit()
+  raise ErrorExit(str(message))
 
 def strip_path(path, keep):
   return ''.join(c for c in path if c.isalnum() or c in keep).strip()
@@ -307,18 +367,26 @@ def folders(dir):
     if os.path.isdir(path):
       yield subdir, path
 
-def copy_all(name_path_list, to_path):
-  import errno, shutil
-  def copy(src, dest):
+def link_all(name_path_list, to_path):
+  # stage files with hardlinks (symlinks, or copies across filesystems) instead of duplicating every page
+  import shutil
+  def link(src, dest):
     try:
-      shutil.copytree(src, dest)
-    except OSError as e:
-      if e.errno == errno.ENOTDIR: # src is file
-        shutil.copy(src, dest)
-      else:
-        error(e)
+      os.link(src, dest)
+    except OSError:
+      try:
+        os.symlink(os.path.abspath(src), dest)
+      except OSError:
+        shutil.copy2(src, dest)
   for name, path in name_path_list:
-    copy(path, f'{to_path}/{name}')
+    dest = f'{to_path}/{name}'
+    try:
+      if os.path.isdir(path):
+        shutil.copytree(path, dest, copy_function=link)
+      else:
+        link(path, dest)
+    except OSError as e:
+      error(e)
 
 
 def split_rotate_2_pages(rotate):
@@ -327,24 +395,85 @@ def split_rotate_2_pages(rotate):
 def single(single):
   return str(0 if single else 2)
 
+def has_alpha(image_path):
+  from PIL import Image
+  with Image.open(image_path) as img: # only reads the header
+    return img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info)
+
 def removeAlpha(image_path):
+  if not has_alpha(image_path):
+    return False
   import wand.image
   with wand.image.Image(filename=image_path) as img:
     if img.alpha_channel:
       img.alpha_channel = 'remove'
       img.background_color = wand.image.Color('white')    
-      img.save(filename=image_path)
+      part_path = f'{image_path}.part.png'
+      img.save(filename=part_path)
+      os.replace(part_path, image_path) # a new file, the page may be a link shared with other chapters
+      return True
+  return False
+
+def remove_alpha_all(image_paths):
+  from concurrent.futures import ThreadPoolExecutor
+  with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor: # ImageMagick releases the GIL
+    removed = [path for path, changed in zip(image_paths, executor.map(removeAlpha, image_paths)) if changed]
+  manifests = {}
+  for path in removed: # the new pages are not downloaded again
+    directory = os.path.dirname(path)
+    manifest = manifests.get(directory)
+    if manifest is None:
+      manifest = manifests[directory] = PageManifest(directory)
+    manifest.add(os.path.basename(path), os.path.getsize(path), file_hash(path))
+  for manifest in manifests.values():
+    manifest.save()
+  return len(removed)
+
+def write_pdf(path, image_paths):
+  import img2pdf
+  if len(image_paths) <= PDF_BATCH_PAGES:
+    with open(path, 'wb') as f:
+      img2pdf.convert(image_paths, outputstream=f)
+    return
+  import pikepdf
+  # big PDFs are built in batches and merged, so only one batch of images is in memory at once
+  with tempfile.TemporaryDirectory() as temp:
+    pdf = pikepdf.Pdf.new()
+    batches = []
+    try:
+      for i in range(0, len(image_paths), PDF_BATCH_PAGES):
+        batch_path = f'{temp}/{i}.pdf'
+        with open(batch_path, 'wb') as f:
+          img2pdf.convert(image_paths[i:i + PDF_BATCH_PAGES], outputstream=f)
+        batch = pikepdf.Pdf.open(batch_path)
+        batches.append(batch)
+        pdf.pages.extend(batch.pages)
+      pdf.save(path)
+    finally:
+      pdf.close()
+      for batch in batches:
+        batch.close()
 
 def convert_to_pdf(path, chapters_paths):
   args = ArgsSingleService().args
-  if not check_exists_file(path):
+  conversion_cache = ConversionCache()
+  key = ConversionCache.key(chapters_paths, ['PDF', bool(args.remove_alpha)])
+  if conversion_cache.get(key, '.pdf', path):
+    METRICS.count('conversion_cache_total', result='hit', format='PDF')
+    print_colored(f'DONE: {os.path.abspath(path)} (converted before)', Fore.GREEN, Style.BRIGHT)
+  else:
+    METRICS.count('conversion_cache_total', result='miss', format='PDF')
     if args.remove_alpha:
       print_dim(f'Removing alpha channel from images for {path}')
-      for img_path in chapters_paths:
-        removeAlpha(img_path)
-    with open(path, "wb") as f:
-      import img2pdf
-      f.write(img2pdf.convert(chapters_paths))
+      removed = remove_alpha_all(chapters_paths)
+      if removed:
+        print_dim(f'Alpha channel removed from {removed} image{plural(removed)}')
+    part_path = f'{path}.part'
+    with METRICS.timer('stage_seconds', stage='pdf'):
+      write_pdf(part_path, chapters_paths)
+    os.replace(part_path, path)
+    conversion_cache.put(key, '.pdf', path)
+    METRICS.count('pages_converted_total', len(chapters_paths), format='PDF')
     print_colored(f'DONE: {os.path.abspath(path)}', Fore.GREEN, Style.BRIGHT)
 
 def fix_corrupted_file(corrupted_file, corrupted_file_path, argv):
@@ -352,6 +481,12 @@ def fix_corrupted_file(corrupted_file, corrupted_file_path, argv):
   local_corrupted_file_path = os.path.abspath(f'{corrupted_file_path}/{corrupted_file}')
   print_dim(local_corrupted_file_path)
   os.remove(local_corrupted_file_path)
+  manifest = PageManifest(os.path.dirname(local_corrupted_file_path))
+  page = manifest.pages.get(os.path.basename(local_corrupted_file_path))
+  if page is not None: # other chapters linking the same content are not reused
+    BlobStore().discard(page['sha256'])
+  manifest.discard(os.path.basename(local_corrupted_file_path))
+  manifest.save()
   if corrupted_file_path != local_corrupted_file_path:
     os.remove(corrupted_file_path)
   cache_convert(argv)
@@ -378,9 +513,37 @@ def cache_convert(argv):
   from kindlecomicconverter.comic2ebook import main as manga2ebook
   try:
     manga2ebook(argv)
-  except Exception as e:
+  except Exception as e: # corrupted pages are fixed and converted again, timed by the callers once per chapter
     convert_except(e, argv)
     
+def convert_chapter(argv, output_name, path, cache_key=None):
+  """Runs in a conversion process, the elapsed seconds are returned to be recorded in the main process"""
+  start = time.monotonic()
+  # KCC names the output after the chapter directory, the same for every series, so parallel conversions write to their own directory
+  with tempfile.TemporaryDirectory(dir=os.path.dirname(path) or '.') as output:
+    cache_convert(['--output', output] + argv)
+    os.replace(f'{output}/{output_name}', path)
+  if cache_key is not None:
+    ConversionCache().put(cache_key, os.path.splitext(path)[1], path)
+  return path, time.monotonic() - start
+
+def conversion_workers():
+  args = ArgsSingleService().args
+  # KCC starts a pool of cpu_count image processes for every conversion, more parallel conversions only overlap their serial parts
+  workers = getattr(args, 'convert_workers', None) or min(CONVERT_WORKERS, os.cpu_count() or 1)
+  memory = getattr(args, 'convert_memory', None) # MB
+  if not memory:
+    import psutil
+    memory = psutil.virtual_memory().available // (1024 * 1024)
+  workers = min(workers, memory // CONVERT_WORKER_MEMORY)
+  return max(1, workers)
+
+def conversion_pool():
+  from concurrent.futures import ProcessPoolExecutor
+  import multiprocessing
+  # spawn, as downloads are still running in other threads of this process
+  return ProcessPoolExecutor(max_workers=conversion_workers(), mp_context=multiprocessing.get_context('spawn'))
+
 def encode_url_format(name):
   return urllib.parse.quote(name)
 
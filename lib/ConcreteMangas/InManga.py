@@ -1,8 +1,10 @@
 import requests
 from typing import Dict, List
-from bs4 import BeautifulSoup
+from urllib.parse import urlparse
 from lib.Common import chapter_directory, exit_if_fails, load_json, network_error, not_found, success
+from lib.Constants import CHAPTERS_CACHE_TTL, SEARCH_CACHE_TTL
 from lib.AbstractMangas.OnlineMangaTemplate import OnlineMangaTemplate
+from lib.HtmlParser import parse_fragments, parse_html
 from lib.results.manga_class import Chapter, Manga
 
 PROVIDER_WEBSITE = "https://inmanga.com"
@@ -12,6 +14,8 @@ SEARCH_URL = "https://inmanga.com/manga/getMangasConsultResult"
 CHAPTER_PAGES_WEBSITE = f"{PROVIDER_WEBSITE}/chapter/chapterIndexControls?identification="
 
 class InManga(OnlineMangaTemplate):
+    IMAGE_HOSTS = [urlparse(PROVIDER_WEBSITE).netloc]
+
     def search(self, manga_name) -> List[Manga]:
         data = {
             'hfilter[generes][]': '-1',
@@ -34,33 +38,32 @@ class InManga(OnlineMangaTemplate):
             'X-Requested-With': 'XMLHttpRequest'
         }
 
-        try:
-            # Alternative Search: https://inmanga.com/OnMangaQuickSearch/Source/QSMangaList.json
-            search = self.SCRAPER.post(SEARCH_URL, data=data, headers=headers)
-            exit_if_fails(search)
-        except requests.exceptions.ConnectionError:
-            network_error()
+        # Alternative Search: https://inmanga.com/OnMangaQuickSearch/Source/QSMangaList.json
+        search = self.cached_request('post', SEARCH_URL, SEARCH_CACHE_TTL, data=data, headers=headers)
+        exit_if_fails(search)
 
-        results_bea = BeautifulSoup(search.content, 'html.parser').find_all("a", href=True, recursive=False)
+        self.search_results.extend(self.parse_search(search.content))
+        return self.search_results
 
-        for result_bea in results_bea:
+    @staticmethod
+    def parse_search(content) -> List[Manga]:
+        results = []
+        for result_a in parse_fragments(content):
+            if result_a.tag != 'a' or result_a.get('href') is None:
+                continue
             result = Manga()
-            result.path = result_bea.get('href')
-            if result.path is None:
-                not_found()
+            result.path = result_a.get('href')
             result.encoded_title = result.path.split('/')[-2] # encoded title
             result.uuid = result.path.split('/')[-1]
-            result.title = result_bea.find('h4').get_text().strip() # may contain special characters
-            
-            self.search_results.append(result)
-            
-        return self.search_results
+            result.title = result_a.find('.//h4').text_content().strip() # may contain special characters
+            results.append(result)
+        return results
     
     def get_chapters(self) -> Dict[float, Chapter]:
         if self.current_manga.chapters:
             return self.current_manga.chapters
         
-        chapters_json = self.scraper_get(CHAPTERS_WEBSITE + self.current_manga.uuid)
+        chapters_json = self.cached_request('get', CHAPTERS_WEBSITE + self.current_manga.uuid, CHAPTERS_CACHE_TTL)
         chapters_full = load_json(chapters_json.content, 'data', 'result')
         #CHAPTERS_IDS = { float(chapter['Number']): chapter['Identification'] for chapter in chapters_full }
         for chapter in chapters_full:
@@ -74,17 +77,19 @@ class InManga(OnlineMangaTemplate):
     
     def get_pages(self, chapter_num) -> None:
         manga_chapter = self.current_manga.chapters[chapter_num]
+        chapter_dir = chapter_directory(self.current_manga.title, chapter_num)
+        if self.chapter_downloaded(chapter_dir):
+            return
         try:
             chapter_page = self.scraper_get(manga_chapter.path)
 
             if success(chapter_page, print_ok=False):
-                html = BeautifulSoup(chapter_page.content, 'html.parser')
-                pages = html.find(id='PageList').find_all(True, recursive=False)
-                for page in pages:
-                    page_id = page.get('value')
-                    page_number = int(page.get_text())
-                    url = IMAGE_WEBSITE + page_id
-                    chapter_dir = chapter_directory(self.current_manga.title, chapter_num)
-                    self.download(page_number, url, chapter_dir, text=f'Page {page_number}/{len(pages)} ({100*page_number//len(pages)}%)')
+                self.download_pages(self.parse_pages(chapter_page.content), chapter_dir)
         except requests.exceptions.ConnectionError:
             network_error()
+
+    @staticmethod
+    def parse_pages(content):
+        """(page_number, url) of the options in the page selector of the chapter"""
+        pages = parse_html(content).get_element_by_id('PageList')
+        return [(int(page.text_content()), IMAGE_WEBSITE + page.get('value')) for page in pages.iterchildren('*')]
@@ -2,9 +2,11 @@
 import ast
 import requests
 from typing import Dict, List
-from bs4 import BeautifulSoup
 from lib.Common import chapter_directory, encode_url_format, exit_if_fails, network_error, not_found, success
+from lib.Constants import CHAPTERS_CACHE_TTL, SEARCH_CACHE_TTL
 from lib.AbstractMangas.OnlineMangaTemplate import OnlineMangaTemplate
+from lib.HtmlParser import parse_html
+from lib.MirrorSelector import MirrorSelector
 from lib.results.manga_class import Chapter, Manga
 import re
 
@@ -13,8 +15,15 @@ IMAGE_WEBSITE = f"https://img1.fashioncomplements.com/uploads"
 CHAPTERS_WEBSITE = f"{PROVIDER_WEBSITE}/library/manga"
 SEARCH_URL = f"{PROVIDER_WEBSITE}/library?title="
 DOMAINS = ["recipeski", "chefac", "fashioncomplements", "recipesandcooker"]
+NUMBER_PATTERN = re.compile(r"[-+]?[.]?[\d]+(?:,\d\d\d)*[\.]?\d*(?:[eE][-+]?\d+)?")
+DIR_PATH_PATTERN = re.compile(r"var dirPath = '(.*)';")
+IMAGES_PATTERN = re.compile(r"var images = JSON.parse(.*);")
 
 class LectorManga(OnlineMangaTemplate):
+    IMAGE_HOSTS = [f"img1.{domain}.com" for domain in DOMAINS]
+    # every image host serves the same uploads, the default one is tried first until they are probed
+    MIRRORS = MirrorSelector([IMAGE_WEBSITE] + [f"https://img1.{domain}.com/uploads" for domain in DOMAINS if f"https://img1.{domain}.com/uploads" != IMAGE_WEBSITE])
+
     def search(self, title) -> List[Manga]:
         data = {
             'title': title,
@@ -35,49 +44,51 @@ class LectorManga(OnlineMangaTemplate):
         }
         
         manga_name_encode = encode_url_format(title)
-        search = self.scraper_get(SEARCH_URL + manga_name_encode, data=data, headers=headers)
-        results_bea = BeautifulSoup(search.content, 'html.parser').find_all(name="a", attrs={"class" : "text-light font-weight-light"}, href=True, recursive=True)
+        search = self.cached_request('get', SEARCH_URL + manga_name_encode, SEARCH_CACHE_TTL, data=data, headers=headers)
+        self.search_results.extend(self.parse_search(search.content))
+        return self.search_results
 
-        for result_bea in results_bea:
+    @staticmethod
+    def parse_search(content) -> List[Manga]:
+        results = []
+        for result_a in parse_html(content).xpath('//a[@class="text-light font-weight-light"][@href]'):
             result = Manga()
-            result.path = result_bea.get('href')
-            if result.path is None:
-                not_found()
+            result.path = result_a.get('href')
             result.encoded_title = result.path.split('/')[-1] # encoded title
             result.uuid = result.path.split('/')[-2]
-            result.title = result_bea.get('title') # may contain special characters
-            
-            self.search_results.append(result)
-            
-        return self.search_results
+            result.title = result_a.get('title') # may contain special characters
+            results.append(result)
+        return results
     
     def get_chapters(self) -> Dict[float, Chapter]:
         if self.current_manga.chapters:
             return self.current_manga.chapters
-        try:
-            url = f"{CHAPTERS_WEBSITE}/{self.current_manga.uuid}/{self.current_manga.title}"
-            search = self.SCRAPER.get(url)
-            exit_if_fails(search)
-        except requests.exceptions.ConnectionError:
-            network_error()
-            
-        chapter_bea = BeautifulSoup(search.content, 'html.parser').find_all(name="h4", attrs={"class" : "mt-2 text-truncate"}, href=False, recursive=True)
-        list_bea = BeautifulSoup(search.content, 'html.parser').find_all(name="ul", attrs={"class" : "list-group list-group-flush chapter-list"}, href=False, recursive=True)
-        
-        i = 0
-        for chapter in chapter_bea:
+        url = f"{CHAPTERS_WEBSITE}/{self.current_manga.uuid}/{self.current_manga.title}"
+        search = self.cached_request('get', url, CHAPTERS_CACHE_TTL)
+        exit_if_fails(search)
+        self.current_manga.chapters.update(self.parse_chapters(search.content))
+        return self.current_manga.chapters
+
+    @staticmethod
+    def parse_chapters(content) -> Dict[float, Chapter]:
+        """Every chapter title is followed by its list of uploads, the first one is downloaded"""
+        chapters = {}
+        html = parse_html(content)
+        titles = html.xpath('//h4[@class="mt-2 text-truncate"]')
+        uploads = html.xpath('//ul[@class="list-group list-group-flush chapter-list"]')
+        for title, upload in zip(titles, uploads):
             manga_chapter = Chapter()
-            chapter_div = str(list_bea[i].contents[1].contents[1].contents[9])
-            manga_chapter.path = BeautifulSoup(chapter_div, 'html.parser').find(name="a", attrs={"class" : "btn btn-default btn-sm"}, href=True, recursive=True).get('href')
+            manga_chapter.path = upload.xpath('./li[1]//a[@class="btn btn-default btn-sm"]/@href')[0]
             manga_chapter.uuid = manga_chapter.path.split('/')[-1]
-            chapter_num = re.findall("[-+]?[.]?[\d]+(?:,\d\d\d)*[\.]?\d*(?:[eE][-+]?\d+)?", chapter.next)
-            self.current_manga.chapters[float(chapter_num[0])] = manga_chapter
-            i = i+1
-
-        return self.current_manga.chapters
+            chapter_num = NUMBER_PATTERN.findall(title.text or '')
+            chapters[float(chapter_num[0])] = manga_chapter
+        return chapters
     
     def get_pages(self, chapter_num) -> None:
         manga_chapter = self.current_manga.chapters[chapter_num]
+        chapter_dir = chapter_directory(self.current_manga.title, chapter_num)
+        if self.chapter_downloaded(chapter_dir):
+            return
         headers = {
                     'Accept-Encoding': 'gzip, deflate',
                     'Accept-Language': 'es-419,es;q=0.8',
@@ -96,16 +107,9 @@ class LectorManga(OnlineMangaTemplate):
                     'sec-gpc': '1'
                 }
         
-        self.renew_scrapper()
         url_1_get = self.scraper_get(manga_chapter.path, headers=headers)
-        url_1_bea = BeautifulSoup(url_1_get.content, 'html.parser')
-        
-        date = re.search("var dirPath = '(.*)';", str(url_1_bea)).group(1).split("/")[-3]
-        id = re.search("var dirPath = '(.*)';", str(url_1_bea)).group(1).split("/")[-2]
-        pages = ast.literal_eval(re.search("var images = JSON.parse(.*);", str(url_1_bea)).group(1).replace('(\'', '').replace('\')', ''))
+        date, id, pages = self.parse_pages(url_1_get.content.decode('utf-8', 'replace')) # avoids guessing the encoding of the whole page
 
-        chapter_dir = chapter_directory(self.current_manga.title, chapter_num)
-        page_number = 1
         headers = {
             'Accept-Encoding': 'gzip, deflate, br',
             'Accept-Language': 'es-419,es;q=0.6',
@@ -123,7 +127,13 @@ class LectorManga(OnlineMangaTemplate):
             'sec-gpc': '1'
         }
         
-        for img in pages:
-            url = f"{IMAGE_WEBSITE}/{date}/{id}/{img}"
-            self.download(page_number, url, chapter_dir, text=f'Page {page_number}/{len(pages)} ({100*page_number//len(pages)}%)', headers=headers)
-            page_number = page_number+1
\ No newline at end of file
+        self.MIRRORS.probe(self.SCRAPER, self.host_limiter)
+        pages = [(page_number, f"{date}/{id}/{img}") for page_number, img in enumerate(pages, start=1)]
+        self.download_pages(pages, chapter_dir, headers=headers, mirrors=self.MIRRORS)
+
+    @staticmethod
+    def parse_pages(text):
+        """Upload date, chapter id and image names from the scripts of the chapter viewer"""
+        dir_path = DIR_PATH_PATTERN.search(text).group(1).split("/")
+        images = IMAGES_PATTERN.search(text).group(1).replace('(\'', '').replace('\')', '')
+        return dir_path[-3], dir_path[-2], ast.literal_eval(images)
\ No newline at end of file
@@ -1,11 +1,11 @@
-from multiprocessing.pool import INIT
 import os
 from pathlib import Path
 from typing import Dict, List
 
-from lib.Common import chapter_directory, decode, encode, folders, manga_directory, titles_match
+from lib.Common import chapter_directory, decode, encode, files, folders, manga_directory, titles_match
 from lib.Constants import MANGA_DIR
 from lib.AbstractMangas.MangaTemplate import MangaTemplate
+from lib.LibraryIndex import LibraryIndex
 from lib.results.manga_class import Chapter, Manga, Page
 
 
@@ -13,14 +13,26 @@ class LocalManga(MangaTemplate):
     def __init__(self):
         super().__init__()
         self.name = "Local"
+        self.index = None
+    
+    def library(self, directory = MANGA_DIR) -> LibraryIndex:
+        if self.index is None or self.index.directory != directory:
+            self.index = LibraryIndex(directory)
+        return self.index
+
+    def close(self):
+        if self.index is not None:
+            self.index.close()
+            self.index = None
     
     def search(self, title, directory = MANGA_DIR) -> List[Manga]:
-        for subdir, path in folders(directory):
-            if titles_match(title, subdir):
-                result = Manga()
-                result.title = decode(subdir)
-                result.path = path
-                self.search_results.append(result)
+        library = self.library(directory)
+        paths = dict(library.series())
+        for _, subdir in library.titles().search(title): # best matches first
+            result = Manga()
+            result.title = decode(subdir)
+            result.path = paths[subdir]
+            self.search_results.append(result)
         
         return self.search_results
     
@@ -29,12 +41,12 @@ class LocalManga(MangaTemplate):
             return self.current_manga.chapters
         
         chapters = {}
-        manga_dir_chapters = os.listdir(self.current_manga.path)
-        for manga_chapter in manga_dir_chapters:
+        series = os.path.basename(self.current_manga.path)
+        for number, path, _, _ in self.library(os.path.dirname(self.current_manga.path)).chapters(series):
             chapter = Chapter()
-            chapter.uuid = manga_chapter
-            chapter.path = manga_chapter
-            chapters[float(chapter.uuid)] = chapter
+            chapter.uuid = os.path.basename(path)
+            chapter.path = path
+            chapters[number] = chapter
         
         self.current_manga.chapters = chapters
         return chapters
@@ -44,12 +56,12 @@ class LocalManga(MangaTemplate):
             return self.current_manga.chapters[chapter_num].pages
         
         pages = {}
+        series = os.path.basename(self.current_manga.path)
         chapter_dir = self.current_manga.chapters[chapter_num].path
-        page_files = os.listdir(chapter_dir)
-        for page_file in page_files:
+        for number, path, _ in self.library(os.path.dirname(self.current_manga.path)).pages(series, chapter_dir):
             page = Page()
-            page.uuid = page_file.split('.')[0]
-            page.path = chapter_dir + "/" + page_file
-            pages[float(page.uuid)] = page
+            page.uuid = os.path.basename(path).split('.')[0]
+            page.path = path
+            pages[number] = page
         self.current_manga.chapters[chapter_num].pages = pages
-        return pages
\ No newline at end of file
+        return pages
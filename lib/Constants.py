@@ -3,9 +3,66 @@ VERSION = '1.6'
 NAME = 'InMangaKindle'
 WEBSITE = 'https://carleslc.me/InMangaKindle/'
 CHAPTERS_FORMAT = 'Format: start..end or chapters with commas. Example: --chapter 3 will download chapter 3, --chapter last will download the last chapter available, --chapters 3..last will download chapters from 3 to the last chapter, --chapter 3 will download only chapter 3, --chapters "3, 12" will download chapters 3 and 12, --chapters "3..12, 15" will download chapters from 3 to 12 and also chapter 15.'
-SUPPORT_PYTHON = [(3,6,0), (3,9,9)]
+SUPPORT_PYTHON = [(3,7,0), (3,9,9)]
 RECOMMENDED_PYTHON = 'https://www.python.org/downloads/release/python-399/'
 MANGA_DIR = './manga'
 FILENAME_KEEP = set(['_', '-', ' ', '.'])
 DIRECTORY_KEEP = FILENAME_KEEP | set(['/'])
-EXTENSION_KEEP = set('.')
\ No newline at end of file
+EXTENSION_KEEP = set('.')
+DOWNLOAD_THREADS = 8
+HOST_CONNECTIONS = 4
+PIPELINE_QUEUE_SIZE = 2
+SEARCH_TIMEOUT = 30
+CACHE_DIR = f'{MANGA_DIR}/.cache'
+RESPONSE_CACHE_DIR = f'{CACHE_DIR}/responses'
+RESPONSE_CACHE_SIZE = 32 * 1024 * 1024 # bytes
+SEARCH_CACHE_TTL = 10 * 60 # seconds
+CHAPTERS_CACHE_TTL = 10 * 60 # seconds
+MANIFEST_FILE = '.manifest.json'
+DOWNLOAD_CHUNK_SIZE = 64 * 1024 # bytes
+FOLLOW_FILE = '.follow.json'
+BATCH_OPTIONS = ['chapters', 'format', 'profile', 'single', 'rotate', 'fullsize', 'cache', 'follow', 'remove_alpha']
+CONVERT_WORKERS = 2 # chapters converted at the same time, KCC already converts the images of every chapter in a pool of one process per CPU
+CONVERT_WORKER_MEMORY = 1024 # MB of a chapter conversion, KCC and its image processes
+PDF_BATCH_PAGES = 200
+LIBRARY_INDEX_FILE = '.cache/library.sqlite'
+FUZZY_THRESHOLD = 0.4
+LIBRARY_MATCH_THRESHOLD = 0.8
+TITLE_SUGGESTIONS = 5
+HOST_RATE = 8.0 # requests per second
+HOST_BURST = 8
+HOST_MIN_RATE = 0.5 # requests per second
+REQUEST_RETRIES = 5
+REQUEST_TIMEOUT = (10, 60) # seconds to connect, and without receiving any byte
+RETRY_STATUS = {429, 500, 502, 503, 504}
+BACKOFF_BASE = 1 # seconds
+BACKOFF_MAX = 120 # seconds
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 60 # seconds
+SESSIONS_DIR = f'{CACHE_DIR}/sessions'
+SESSION_TTL = 12 * 60 * 60 # seconds
+POOL_CONNECTIONS = 10 # hosts with pooled connections
+POOL_SIZE = 10 # connections kept alive per host
+MIRROR_FAILURES = 3
+MIRROR_COOLDOWN = 60 # seconds
+MIRROR_PROBE_INTERVAL = 10 * 60 # seconds
+MIRROR_PROBE_TIMEOUT = 5 # seconds
+METRICS_PREFIX = 'manga_'
+METRICS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300) # seconds
+VERSION_CHECK_FILE = f'{CACHE_DIR}/version.json'
+VERSION_CHECK_TTL = 24 * 60 * 60 # seconds
+VERSION_CHECK_TIMEOUT = 10
+DEPENDENCIES_STAMP = '.dependencies.stamp'
+BLOBS_DIR = f'{MANGA_DIR}/.blobs'
+BLOB_INDEX_FILE = f'{CACHE_DIR}/blobs.sqlite'
+CONVERSIONS_DIR = f'{CACHE_DIR}/conversions'
+CONVERSION_CACHE_SIZE = 2 * 1024 * 1024 * 1024 # bytes
+JOBS_FILE = f'{CACHE_DIR}/jobs.sqlite'
+SERVICE_PORT = 8765
+SERVICE_DOWNLOAD_JOBS = 2
+SERVICE_CONVERT_JOBS = 1
+WORK_QUEUE_FILE = f'{CACHE_DIR}/shards.sqlite'
+SHARD_LEASE_SECONDS = 120
+SHARD_ATTEMPTS = 3
+SHARD_POLL_SECONDS = 2
+SHARD_IDLE_SECONDS = 30 # a worker with nothing to do waits this long for new chapters before exiting
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+from lib.Constants import CONVERSION_CACHE_SIZE, CONVERSIONS_DIR
+from lib.PageManifest import PageManifest, file_hash
+
+def _link(source, destination):
+    """Replace destination with a hardlink to source, or a copy when hardlinks are not supported"""
+    if os.path.isfile(destination) and os.path.samefile(source, destination): # renaming a link over the same file does nothing
+        return
+    part_path = f'{destination}.part'
+    if os.path.lexists(part_path):
+        os.remove(part_path)
+    try:
+        os.link(source, part_path)
+    except OSError:
+        shutil.copy2(source, part_path)
+    os.replace(part_path, destination)
+
+class ConversionCache:
+    """
+    Converted files (KCC e-books and PDFs) stored by a key made of the hashes of the converted pages
+    and the conversion options, so converting the same pages with the same options again only links
+    the stored file. The least recently used files are removed when the cache grows over max_size bytes.
+    """
+    def __init__(self, directory=CONVERSIONS_DIR, max_size=CONVERSION_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def chapter_pages(chapter_dir):
+        """Files KCC converts from a chapter directory, in name order"""
+        return sorted(entry.path for entry in os.scandir(chapter_dir) if entry.is_file() and not entry.name.startswith('.') and not entry.name.endswith(('.part', '.link')))
+
+    @staticmethod
+    def kcc_options(argv, title):
+        """KCC arguments of a conversion without the output directory"""
+        options = list(argv)
+        if '--output' in options:
+            index = options.index('--output')
+            del options[index:index + 2]
+        return options + ['--title', title]
+
+    @staticmethod
+    def key(page_paths, options):
+        """Hash of the content of the pages, in order, and the options. Hashes are read from the chapter manifests when possible"""
+        manifests = {}
+        pages = []
+        for path in page_paths:
+            directory, name = os.path.split(path)
+            manifest = manifests.get(directory)
+            if manifest is None:
+                manifest = manifests[directory] = PageManifest(directory)
+            sha256 = manifest.pages[name]['sha256'] if manifest.has(name) else file_hash(path)
+            pages.append((os.path.basename(directory), name, sha256)) # chapter and page names are part of the output
+        content = json.dumps([pages, list(options)], separators=(',', ':'))
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def artifact(self, key, extension):
+        return f'{self.directory}/{key}{extension}'
+
+    def get(self, key, extension, path):
+        """Link the stored conversion to path, False when it is not stored"""
+        artifact = self.artifact(key, extension)
+        with self.lock:
+            if not os.path.isfile(artifact):
+                return False
+            os.utime(artifact) # recently used
+            _link(artifact, path)
+        return True
+
+    def put(self, key, extension, path):
+        os.makedirs(self.directory, exist_ok=True)
+        with self.lock:
+            _link(path, self.artifact(key, extension))
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.is_file() and not entry.name.endswith('.part'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            except OSError: # removed by another conversion process
+                pass
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            size -= entry_size
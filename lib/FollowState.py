@@ -0,0 +1,71 @@
+import json
+import os
+import time
+from typing import Dict, List
+
+from lib.AtomicFile import replace_file
+from lib.Constants import FOLLOW_FILE
+from lib.ConcreteMangas.LocalManga import LocalManga
+from lib.results.manga_class import Chapter
+
+class FollowState:
+    """Chapters already seen of a followed series, stored in its manga directory"""
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = f'{directory}/{FOLLOW_FILE}'
+        self.provider = None
+        self.uuid = None
+        self.chapters = {}
+        self.updated = None
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                state = json.load(f)
+            self.provider = state.get('provider')
+            self.uuid = state.get('uuid')
+            self.chapters = state.get('chapters', {})
+            self.updated = state.get('updated')
+        except (OSError, ValueError):
+            pass
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        state = { 'provider': self.provider, 'uuid': self.uuid, 'chapters': self.chapters, 'updated': self.updated }
+        with replace_file(self.path) as f:
+            json.dump(state, f, indent=1, sort_keys=True)
+
+    def follows(self, manga_service) -> bool:
+        """False when the state is of another provider or series downloaded to the same directory. Local series have neither"""
+        if self.provider is None or isinstance(manga_service, LocalManga):
+            return True
+        return self.provider == manga_service.name and str(self.uuid) == str(manga_service.current_manga.uuid)
+
+    def reset(self):
+        self.provider = None
+        self.uuid = None
+        self.chapters = {}
+
+    def new_chapters(self, manga_service, chapters: List[float]) -> List[float]:
+        """Chapters not seen before, or uploaded again with another id (the ids of local chapters are their directories)"""
+        all_chapters: Dict[float, Chapter] = {} if isinstance(manga_service, LocalManga) else manga_service.current_manga.chapters
+        def seen(chapter):
+            seen_id = self.chapters.get(f'{chapter:g}')
+            if seen_id is None:
+                return False
+            current_id = all_chapters[chapter].uuid if chapter in all_chapters else ''
+            return not (seen_id and current_id and str(current_id) != str(seen_id))
+        return [chapter for chapter in chapters if not seen(chapter)]
+
+    def update(self, manga_service, chapters: List[float]):
+        if isinstance(manga_service, LocalManga): # the provider and the chapter ids stay the ones of the last online run
+            for chapter in chapters:
+                self.chapters.setdefault(f'{chapter:g}', '')
+        else:
+            all_chapters: Dict[float, Chapter] = manga_service.current_manga.chapters
+            self.provider = manga_service.name
+            self.uuid = manga_service.current_manga.uuid
+            for chapter in chapters:
+                self.chapters[f'{chapter:g}'] = all_chapters[chapter].uuid if chapter in all_chapters else ''
+        self.updated = time.time()
@@ -0,0 +1,63 @@
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from typing import List, Tuple
+
+from lib.Constants import FUZZY_THRESHOLD
+
+def normalize(title):
+    """Lowercase words without accents nor punctuation"""
+    title = ''.join(c for c in unicodedata.normalize('NFKD', title) if not unicodedata.combining(c))
+    return ' '.join(re.sub(r'[\W_]+', ' ', title.lower()).split())
+
+def trigrams(text):
+    text = f'  {text} '
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def score(query_trigrams, title_trigrams, shared):
+    # mean of the similarity of both titles and how much of the query is in the title, so partial titles rank high
+    dice = 2 * shared / (len(query_trigrams) + len(title_trigrams))
+    containment = shared / len(query_trigrams)
+    return (dice + containment) / 2
+
+def similarity(query, title):
+    query, title = normalize(query), normalize(title)
+    if query == title:
+        return 1.0
+    query_trigrams, title_trigrams = trigrams(query), trigrams(title)
+    return score(query_trigrams, title_trigrams, len(query_trigrams & title_trigrams))
+
+class TrigramIndex:
+    """In-memory trigram index of titles returning ranked candidates for misspelled, partial or unaccented queries"""
+    def __init__(self, titles=()):
+        self.titles = []
+        self.normalized = []
+        self.title_trigrams = []
+        self.postings = defaultdict(list)
+        for title in titles:
+            self.add(title)
+
+    def add(self, title):
+        i = len(self.titles)
+        normalized = normalize(title)
+        self.titles.append(title)
+        self.normalized.append(normalized)
+        self.title_trigrams.append(trigrams(normalized))
+        for gram in self.title_trigrams[i]:
+            self.postings[gram].append(i)
+
+    def search(self, query, limit=None, threshold=FUZZY_THRESHOLD) -> List[Tuple[float, str]]:
+        """(score, title) of the titles similar to the query, best first"""
+        query = normalize(query)
+        query_trigrams = trigrams(query)
+        shared = Counter()
+        for gram in query_trigrams:
+            for i in self.postings.get(gram, ()):
+                shared[i] += 1
+        results = []
+        for i, count in shared.items():
+            title_score = 1.0 if self.normalized[i] == query else score(query_trigrams, self.title_trigrams[i], count)
+            if title_score >= threshold:
+                results.append((title_score, self.titles[i]))
+        results.sort(key=lambda result: (-result[0], result[1]))
+        return results[:limit] if limit else results
@@ -0,0 +1,20 @@
+import threading
+
+import lxml.html
+
+_local = threading.local() # lxml parsers cannot be shared between threads
+
+def _parser():
+    if not hasattr(_local, 'parser'):
+        _local.parser = lxml.html.HTMLParser(encoding='utf-8') # providers serve utf-8, often without a charset
+    return _local.parser
+
+def parse_html(content):
+    """Parse a whole document once with lxml"""
+    return lxml.html.fromstring(content, parser=_parser())
+
+def parse_fragments(content):
+    """Top level elements of an html fragment, text between them is skipped"""
+    if not content.strip():
+        return []
+    return [element for element in lxml.html.fragments_fromstring(content, parser=_parser()) if not isinstance(element, str)]
@@ -0,0 +1,91 @@
+import threading
+from contextlib import contextmanager
+
+import requests
+
+from lib.Common import print_dim
+
+@contextmanager
+def body_errors():
+    """httpx errors while reading a body as the requests exceptions the downloads handle"""
+    import httpx
+    try:
+        yield
+    except httpx.RemoteProtocolError as e: # connection closed in the middle of the body
+        raise requests.exceptions.ChunkedEncodingError(e)
+    except httpx.TransportError as e:
+        raise requests.exceptions.ConnectionError(e)
+
+class Http2Response:
+    """httpx streamed response exposing the attributes used from requests.Response"""
+    def __init__(self, response):
+        self.response = response
+        self.status_code = response.status_code
+        self.url = str(response.url)
+        self.headers = response.headers
+
+    @property
+    def content(self):
+        with body_errors():
+            return self.response.read()
+
+    def iter_content(self, chunk_size=None):
+        with body_errors():
+            yield from self.response.iter_bytes(chunk_size)
+
+    def close(self):
+        self.response.close()
+
+class Http2Transport:
+    """
+    Page requests multiplexed over one HTTP/2 connection per host with httpx, sharing the
+    cookies and user agent of the provider scraper. Needs the optional httpx[http2] package.
+    """
+    _transports = {}
+    _lock = threading.Lock()
+
+    def __init__(self, scraper, max_connections):
+        import httpx
+        self.httpx = httpx
+        self.client = httpx.Client(
+            http2=True,
+            headers={ 'User-Agent': scraper.headers.get('User-Agent') },
+            cookies=scraper.cookies,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+
+    @staticmethod
+    def get(provider, scraper, max_connections):
+        """Transport for the provider, None when httpx is not installed or HTTP/2 was disabled for it"""
+        with Http2Transport._lock:
+            if provider not in Http2Transport._transports:
+                try:
+                    Http2Transport._transports[provider] = Http2Transport(scraper, max_connections)
+                except ImportError:
+                    print_dim('HTTP/2 needs httpx: pip install "httpx[http2]". Using HTTP/1.1')
+                    Http2Transport._transports[provider] = None
+            return Http2Transport._transports[provider]
+
+    @staticmethod
+    def disable(provider):
+        with Http2Transport._lock:
+            transport = Http2Transport._transports.get(provider)
+            if transport is not None:
+                transport.client.close()
+            Http2Transport._transports[provider] = None
+
+    def request(self, method, url, headers=None, data=None, stream=False, timeout=None):
+        options = {}
+        if timeout is not None: # (connect, read) as in requests
+            options['timeout'] = self.httpx.Timeout(timeout[1], connect=timeout[0]) if isinstance(timeout, tuple) else timeout
+        try:
+            response = self.client.send(self.client.build_request(method, url, headers=headers, data=data, **options), stream=True)
+        except self.httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(e)
+        except self.httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(e)
+        response = Http2Response(response)
+        if not stream:
+            response.content
+        return response
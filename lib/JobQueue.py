@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from lib.Constants import JOBS_FILE
+
+QUEUED = 'queued'
+DOWNLOADING = 'downloading'
+DOWNLOADED = 'downloaded'
+CONVERTING = 'converting'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+ACTIVE = (QUEUED, DOWNLOADING, DOWNLOADED, CONVERTING)
+RUNNING = (DOWNLOADING, CONVERTING)
+INTERRUPTED = {DOWNLOADING: QUEUED, CONVERTING: DOWNLOADED} # status to resume a job from
+
+def job_key(request):
+    """Identical requests (the same title written differently and the same options) have the same key"""
+    request = dict(request, title=' '.join(str(request.get('title', '')).lower().split()))
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+class JobQueue:
+    """
+    Persistent queue of the --serve jobs in SQLite: queued -> downloading -> downloaded -> converting -> done
+    (or failed or cancelled). Jobs survive restarts, the ones interrupted in the middle of a stage are resumed
+    from the start of that stage. An identical request is not queued again while the first one is active.
+    """
+    def __init__(self, path=JOBS_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None) # transactions are explicit
+        self.connection.row_factory = sqlite3.Row
+        with self.lock:
+            self.connection.executescript('''
+                CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT, request TEXT, status TEXT, result TEXT, error TEXT, cancel INTEGER DEFAULT 0, created REAL, updated REAL);
+                CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+                CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key);
+            ''')
+
+    def close(self):
+        self.connection.close()
+
+    def _transaction(self, work):
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE') # other processes wait, claims are never given twice
+            try:
+                result = work(self.connection)
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+            self.connection.execute('COMMIT')
+            return result
+
+    @staticmethod
+    def _job(row):
+        if row is None:
+            return None
+        job = dict(row)
+        job['request'] = json.loads(job['request'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        job['cancel'] = bool(job['cancel'])
+        del job['key']
+        return job
+
+    def submit(self, request):
+        """(job, True) for a new job, (active job, False) when an identical request is already queued or running"""
+        key = job_key(request)
+        def submit(connection):
+            row = connection.execute(f"SELECT * FROM jobs WHERE key = ? AND status IN ({', '.join('?' * len(ACTIVE))}) AND cancel = 0 ORDER BY id LIMIT 1", (key,) + ACTIVE).fetchone()
+            if row is not None:
+                return row, False
+            now = time.time()
+            id = connection.execute('INSERT INTO jobs (key, request, status, created, updated) VALUES (?, ?, ?, ?, ?)', (key, json.dumps(request), QUEUED, now, now)).lastrowid
+            return connection.execute('SELECT * FROM jobs WHERE id = ?', (id,)).fetchone(), True
+        row, created = self._transaction(submit)
+        return self._job(row), created
+
+    def get(self, id):
+        with self.lock:
+            return self._job(self.connection.execute('SELECT * FROM jobs WHERE id = ?', (id,)).fetchone())
+
+    def list(self, status=None, limit=100):
+        """Latest jobs first"""
+        with self.lock:
+            if status:
+                rows = self.connection.execute('SELECT * FROM jobs WHERE status = ? ORDER BY id DESC LIMIT ?', (status, limit)).fetchall()
+            else:
+                rows = self.connection.execute('SELECT * FROM jobs ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+        return [self._job(row) for row in rows]
+
+    def claim(self, status, next_status):
+        """Oldest job in status, moved to next_status, or None"""
+        def claim(connection):
+            row = connection.execute('SELECT id FROM jobs WHERE status = ? AND cancel = 0 ORDER BY id LIMIT 1', (status,)).fetchone()
+            if row is None:
+                return None
+            connection.execute('UPDATE jobs SET status = ?, updated = ? WHERE id = ?', (next_status, time.time(), row['id']))
+            return connection.execute('SELECT * FROM jobs WHERE id = ?', (row['id'],)).fetchone()
+        return self._job(self._transaction(claim))
+
+    def update(self, id, status, result=None, error=None):
+        """A job cancelled while running ends cancelled whatever its stage returned"""
+        def update(connection):
+            cancel = connection.execute('SELECT cancel FROM jobs WHERE id = ?', (id,)).fetchone()
+            final = CANCELLED if cancel and cancel['cancel'] else status
+            connection.execute('UPDATE jobs SET status = ?, result = coalesce(?, result), error = ?, updated = ? WHERE id = ?',
+                               (final, json.dumps(result) if result is not None else None, error, time.time(), id))
+            return final
+        return self._transaction(update)
+
+    def cancel(self, id):
+        """Waiting jobs are cancelled at once, running jobs at the next chapter. None if the job does not exist"""
+        def cancel(connection):
+            row = connection.execute('SELECT status FROM jobs WHERE id = ?', (id,)).fetchone()
+            if row is None:
+                return None
+            if row['status'] in RUNNING:
+                connection.execute('UPDATE jobs SET cancel = 1, updated = ? WHERE id = ?', (time.time(), id))
+            elif row['status'] in ACTIVE:
+                connection.execute('UPDATE jobs SET status = ?, cancel = 1, updated = ? WHERE id = ?', (CANCELLED, time.time(), id))
+            return connection.execute('SELECT * FROM jobs WHERE id = ?', (id,)).fetchone()
+        return self._job(self._transaction(cancel))
+
+    def cancel_requested(self, id):
+        with self.lock:
+            row = self.connection.execute('SELECT cancel FROM jobs WHERE id = ?', (id,)).fetchone()
+        return row is None or bool(row['cancel'])
+
+    def recover(self):
+        """Jobs left running by a stopped service go back to the start of their stage. Returns how many"""
+        def recover(connection):
+            recovered = 0
+            connection.execute(f"UPDATE jobs SET status = ?, updated = ? WHERE cancel = 1 AND status IN ({', '.join('?' * len(RUNNING))})", (CANCELLED, time.time()) + RUNNING)
+            for running, waiting in INTERRUPTED.items():
+                recovered += connection.execute('UPDATE jobs SET status = ?, updated = ? WHERE status = ?', (waiting, time.time(), running)).rowcount
+            return recovered
+        return self._transaction(recover)
@@ -0,0 +1,150 @@
+import os
+import sqlite3
+import threading
+import time
+
+from lib.Common import encode
+from lib.Constants import LIBRARY_INDEX_FILE, MANGA_DIR
+from lib.FuzzySearch import TrigramIndex
+
+def title_key(title):
+    return encode(title).upper().strip()
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def _is_number(name):
+    try:
+        float(name)
+        return True
+    except ValueError:
+        return False
+
+class LibraryIndex:
+    """
+    SQLite index of the downloaded library (series, chapters and pages) stored in the manga directory.
+    Directories are only listed again when their modification time changes: the series list when the
+    manga directory changes, and the chapters and pages of a series when it is requested.
+    """
+    _lock = threading.Lock()
+
+    def __init__(self, directory=MANGA_DIR):
+        self.directory = directory
+        self._titles = None
+        self._found = None
+        path = f'{directory}/{LIBRARY_INDEX_FILE}' # in a subdirectory, so writing the index does not change the manga directory mtime
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.executescript('''
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER);
+                CREATE TABLE IF NOT EXISTS series (name TEXT PRIMARY KEY, key TEXT, path TEXT, mtime INTEGER);
+                CREATE INDEX IF NOT EXISTS series_key ON series (key);
+                CREATE TABLE IF NOT EXISTS chapters (series TEXT, name TEXT, number REAL, path TEXT, mtime INTEGER, pages INTEGER, size INTEGER, PRIMARY KEY (series, name));
+                CREATE TABLE IF NOT EXISTS pages (series TEXT, chapter TEXT, number REAL, path TEXT, size INTEGER, PRIMARY KEY (series, chapter, path));
+                CREATE TABLE IF NOT EXISTS found (provider TEXT, id TEXT, title TEXT, seen REAL, PRIMARY KEY (provider, id));
+            ''')
+
+    def close(self):
+        self.connection.close()
+
+    def series(self):
+        self._update_series()
+        return self.connection.execute('SELECT name, path FROM series ORDER BY name').fetchall()
+
+    def titles(self) -> TrigramIndex:
+        """Trigram index of the series names, rebuilt only when the series change"""
+        series = [name for name, _ in self.series()]
+        if self._titles is None or self._titles.titles != series:
+            self._titles = TrigramIndex(series)
+        return self._titles
+
+    def remember(self, provider, mangas):
+        """Titles found searching a provider, so they can be suggested later"""
+        with LibraryIndex._lock, self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO found VALUES (?, ?, ?, ?)', [(provider, str(manga.uuid), manga.title, time.time()) for manga in mangas])
+        self._found = None
+
+    def found_titles(self) -> TrigramIndex:
+        """Trigram index of the titles found searching the providers"""
+        if self._found is None:
+            self._found = TrigramIndex(title for title, in self.connection.execute('SELECT DISTINCT title FROM found ORDER BY title'))
+        return self._found
+
+    def chapters(self, series):
+        """(number, path, pages, size) of every chapter of the series"""
+        self._update_chapters(series)
+        return self.connection.execute('SELECT number, path, pages, size FROM chapters WHERE series = ? ORDER BY number', (series,)).fetchall()
+
+    def pages(self, series, chapter_path):
+        """(number, path, size) of every page of the chapter"""
+        self._update_chapters(series)
+        chapter = os.path.basename(chapter_path)
+        return self.connection.execute('SELECT number, path, size FROM pages WHERE series = ? AND chapter = ? ORDER BY number', (series, chapter)).fetchall()
+
+    def _update_series(self):
+        mtime = _mtime(self.directory)
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'mtime'").fetchone()
+        if row is not None and row[0] == mtime:
+            return
+        with LibraryIndex._lock, self.connection:
+            indexed = {name for name, in self.connection.execute('SELECT name FROM series')}
+            found = set()
+            for entry in os.scandir(self.directory):
+                if entry.name.startswith('.') or not entry.is_dir():
+                    continue
+                found.add(entry.name)
+                if entry.name not in indexed: # chapters are indexed on first use
+                    self.connection.execute('INSERT INTO series VALUES (?, ?, ?, NULL)', (entry.name, title_key(entry.name), os.path.abspath(entry.path)))
+            for name in indexed - found:
+                self._remove_series(name)
+            self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('mtime', ?)", (mtime,))
+
+    def _update_chapters(self, series):
+        row = self.connection.execute('SELECT path, mtime FROM series WHERE name = ?', (series,)).fetchone()
+        if row is None:
+            self._update_series()
+            row = self.connection.execute('SELECT path, mtime FROM series WHERE name = ?', (series,)).fetchone()
+            if row is None:
+                return
+        path, indexed_mtime = row
+        with LibraryIndex._lock, self.connection:
+            mtime = _mtime(path)
+            if mtime is None:
+                self._remove_series(series)
+                return
+            if mtime != indexed_mtime:
+                indexed = {name for name, in self.connection.execute('SELECT name FROM chapters WHERE series = ?', (series,))}
+                found = set()
+                for entry in os.scandir(path):
+                    if entry.name.startswith('.') or not entry.is_dir() or not _is_number(entry.name):
+                        continue
+                    found.add(entry.name)
+                    if entry.name not in indexed:
+                        self.connection.execute('INSERT INTO chapters VALUES (?, ?, ?, ?, NULL, 0, 0)', (series, entry.name, float(entry.name), os.path.abspath(entry.path)))
+                for name in indexed - found:
+                    self.connection.execute('DELETE FROM chapters WHERE series = ? AND name = ?', (series, name))
+                    self.connection.execute('DELETE FROM pages WHERE series = ? AND chapter = ?', (series, name))
+                self.connection.execute('UPDATE series SET mtime = ? WHERE name = ?', (mtime, series))
+            for name, chapter_path, chapter_mtime in self.connection.execute('SELECT name, path, mtime FROM chapters WHERE series = ?', (series,)).fetchall():
+                if _mtime(chapter_path) != chapter_mtime:
+                    self._update_pages(series, name, chapter_path)
+
+    def _update_pages(self, series, chapter, chapter_path):
+        mtime = _mtime(chapter_path)
+        pages = []
+        for entry in os.scandir(chapter_path):
+            page_number = entry.name.split('.')[0]
+            if entry.name.endswith('.png') and entry.is_file() and _is_number(page_number): # skips manifest and partial downloads
+                pages.append((series, chapter, float(page_number), os.path.abspath(entry.path), entry.stat().st_size))
+        self.connection.execute('DELETE FROM pages WHERE series = ? AND chapter = ?', (series, chapter))
+        self.connection.executemany('INSERT INTO pages VALUES (?, ?, ?, ?, ?)', pages)
+        self.connection.execute('UPDATE chapters SET mtime = ?, pages = ?, size = ? WHERE series = ? AND name = ?', (mtime, len(pages), sum(page[-1] for page in pages), series, chapter))
+
+    def _remove_series(self, series):
+        self.connection.execute('DELETE FROM series WHERE name = ?', (series,))
+        self.connection.execute('DELETE FROM chapters WHERE series = ?', (series,))
+        self.connection.execute('DELETE FROM pages WHERE series = ?', (series,))
@@ -0,0 +1,213 @@
+import json
+import re
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from colorama import Fore, Style
+
+from lib.Common import print_colored, print_dim
+from lib.Constants import BATCH_OPTIONS, SERVICE_CONVERT_JOBS, SERVICE_DOWNLOAD_JOBS, SERVICE_PORT
+from lib.JobQueue import ACTIVE, CONVERTING, DONE, DOWNLOADED, DOWNLOADING, FAILED, QUEUED, JobQueue
+from lib.Metrics import METRICS
+
+JOB_OPTIONS = BATCH_OPTIONS + ['provider', 'id']
+POLL_SECONDS = 1 # workers also look for jobs submitted by other processes
+MAX_WAIT = 300 # seconds a watch request (?wait=) can be kept open
+
+def parse_job(body):
+    """Job request from the json body of POST /jobs, ValueError when it is not valid"""
+    try:
+        request = json.loads(body or b'null')
+    except ValueError:
+        raise ValueError('The body is not json')
+    if isinstance(request, str):
+        request = { 'title': request }
+    if not isinstance(request, dict) or not isinstance(request.get('title'), str) or not request['title'].strip():
+        raise ValueError("A job needs a 'title'")
+    unknown = set(request) - set(JOB_OPTIONS) - {'title'}
+    if unknown:
+        raise ValueError(f"Unknown options: {', '.join(sorted(unknown))}")
+    return request
+
+class MangaService:
+    """
+    Long running mode (--serve): jobs submitted to a localhost HTTP/JSON API are stored in a JobQueue,
+    downloaded by download_jobs worker threads and then converted by convert_jobs worker threads, so
+    the next series is downloading while the previous one is converting. A series is processed by one
+    job at a time.
+
+    download(request, cancelled, series_lock) returns (result, convert) and convert(request, result,
+    cancelled, series_lock) the final result. cancelled() is True once the job is cancelled, and
+    series_lock(title) is held while the files of the series are written. Both exit with error().
+    """
+    def __init__(self, download, convert, port=SERVICE_PORT, download_jobs=SERVICE_DOWNLOAD_JOBS, convert_jobs=SERVICE_CONVERT_JOBS, queue=None):
+        self.download = download
+        self.convert = convert
+        self.port = port
+        self.download_jobs = max(1, download_jobs)
+        self.convert_jobs = max(1, convert_jobs)
+        self.queue = queue or JobQueue()
+        self.changed = threading.Condition()
+        self.stopping = threading.Event()
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+        self.server = None
+
+    def series_lock(self, title) -> threading.Lock:
+        with self.locks_lock:
+            return self.locks.setdefault(title.lower(), threading.Lock())
+
+    def notify(self):
+        with self.changed:
+            self.changed.notify_all()
+
+    def start(self):
+        recovered = self.queue.recover()
+        if recovered:
+            print_dim(f'{recovered} interrupted job{"s" if recovered != 1 else ""} will be resumed')
+        workers = [(QUEUED, DOWNLOADING, self._download)] * self.download_jobs + [(DOWNLOADED, CONVERTING, self._convert)] * self.convert_jobs
+        for status, running, run in workers:
+            threading.Thread(target=self._work, args=(status, running, run), daemon=True).start()
+        self.server = ThreadingHTTPServer(('127.0.0.1', self.port), self.handler())
+        self.server.daemon_threads = True
+        return self
+
+    def serve_forever(self):
+        self.start()
+        print_colored(f'Waiting for jobs on http://localhost:{self.server.server_address[1]}/jobs - Stop with Ctrl+C', Fore.BLUE, Style.BRIGHT)
+        try:
+            self.server.serve_forever()
+        finally: # running jobs are resumed in the next start
+            self.stop()
+
+    def stop(self):
+        self.stopping.set()
+        self.notify()
+        if self.server is not None:
+            self.server.server_close()
+
+    def _work(self, status, running, run):
+        while not self.stopping.is_set():
+            job = self.queue.claim(status, running)
+            if job is None:
+                with self.changed:
+                    self.changed.wait(POLL_SECONDS)
+                continue
+            self.notify()
+            stage = 'download' if running == DOWNLOADING else 'convert'
+            print_colored(f"\n[job {job['id']}] {stage} {job['request']['title']}", Fore.MAGENTA, Style.BRIGHT)
+            try:
+                next_status, result = run(job)
+                error = None
+            except SystemExit as e: # error() exits
+                next_status, result, error = FAILED, None, getattr(e, 'message', '') or 'Failed'
+            except Exception as e:
+                traceback.print_exc()
+                next_status, result, error = FAILED, None, str(e) or type(e).__name__
+            next_status = self.queue.update(job['id'], next_status, result, error)
+            METRICS.count('jobs_total', stage=stage, status=next_status)
+            print_colored(f"[job {job['id']}] {next_status}" + (f': {error}' if error else ''), Fore.GREEN if next_status in (DONE, DOWNLOADED) else Fore.RED)
+            self.notify()
+
+    def _cancelled(self, job):
+        return lambda: self.queue.cancel_requested(job['id'])
+
+    def _download(self, job):
+        result, convert = self.download(job['request'], self._cancelled(job), self.series_lock)
+        return (DOWNLOADED if convert else DONE), result
+
+    def _convert(self, job):
+        return DONE, self.convert(job['request'], job['result'], self._cancelled(job), self.series_lock)
+
+    def wait(self, id, seconds):
+        """The job once it is not active, or when seconds pass"""
+        deadline = time.monotonic() + seconds
+        job = self.queue.get(id)
+        while job is not None and job['status'] in ACTIVE and time.monotonic() < deadline and not self.stopping.is_set():
+            with self.changed:
+                self.changed.wait(max(0, min(POLL_SECONDS, deadline - time.monotonic())))
+            job = self.queue.get(id)
+        return job
+
+    def handler(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def send_json(self, status, body):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def route(self):
+                """(job id or None, query) of /jobs and /jobs/<id>, None for other paths"""
+                url = urlparse(self.path)
+                match = re.fullmatch(r'/jobs(?:/(\d+))?/?', url.path)
+                if match is None:
+                    self.send_json(404, { 'error': 'Not found' })
+                    return None
+                return (int(match.group(1)) if match.group(1) else None), parse_qs(url.query)
+
+            def do_GET(self):
+                route = self.route()
+                if route is None:
+                    return
+                id, query = route
+                if id is None:
+                    return self.send_json(200, service.queue.list(query.get('status', [None])[0]))
+                try:
+                    wait = min(MAX_WAIT, float(query.get('wait', [0])[0]))
+                except ValueError:
+                    return self.send_json(400, { 'error': 'wait must be a number of seconds' })
+                job = service.wait(id, wait) if wait > 0 else service.queue.get(id)
+                if job is None:
+                    return self.send_json(404, { 'error': f'There is no job {id}' })
+                self.send_json(200, job)
+
+            def do_POST(self):
+                route = self.route()
+                if route is None:
+                    return
+                if route[0] is not None:
+                    return self.send_json(405, { 'error': 'Jobs are submitted to /jobs' })
+                if self.headers.get('Content-Length') is None:
+                    return self.send_json(411, { 'error': 'Content-Length is required' })
+                try:
+                    length = int(self.headers['Content-Length'])
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    return self.send_json(400, { 'error': 'Content-Length must be a number of bytes' })
+                try:
+                    request = parse_job(self.rfile.read(length))
+                except ValueError as e:
+                    return self.send_json(400, { 'error': str(e) })
+                job, created = service.queue.submit(request)
+                if created:
+                    service.notify()
+                    self.send_json(201, job)
+                else: # identical job already queued or running
+                    self.send_json(200, dict(job, duplicate=True))
+
+            def do_DELETE(self):
+                route = self.route()
+                if route is None:
+                    return
+                id = route[0]
+                if id is None:
+                    return self.send_json(405, { 'error': 'Jobs are cancelled at /jobs/<id>' })
+                job = service.queue.cancel(id)
+                if job is None:
+                    return self.send_json(404, { 'error': f'There is no job {id}' })
+                service.notify()
+                self.send_json(200 if job['cancel'] else 409, job) # finished jobs cannot be cancelled
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
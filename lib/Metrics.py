@@ -0,0 +1,192 @@
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from lib.Constants import METRICS_BUCKETS, METRICS_PREFIX
+
+def _labels(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels, extra=()):
+    labels = list(labels) + list(extra)
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+class Histogram:
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class JsonLinesSink:
+    """Appends every counter increment and observation to a file, one JSON object per line"""
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, 'a', encoding='utf-8')
+        self.lock = threading.Lock()
+
+    def emit(self, event):
+        line = json.dumps(event, separators=(',', ':')) + '\n'
+        with self.lock:
+            self.file.write(line)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+class PrometheusSink:
+    """
+    Current values in the Prometheus text format, written to a file when the run ends
+    (for the node exporter textfile collector) and/or served on http://localhost:port/metrics while it runs.
+    """
+    def __init__(self, metrics, path=None, port=None):
+        self.metrics = metrics
+        self.path = path
+        self.server = None
+        if port is not None:
+            from http.server import ThreadingHTTPServer
+            self.server = ThreadingHTTPServer(('127.0.0.1', port), self.handler())
+            self.server.daemon_threads = True
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def handler(self):
+        from http.server import BaseHTTPRequestHandler
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def emit(self, event):
+        pass # values are read from the registry when exported
+
+    def write(self):
+        if self.path:
+            part_path = f'{self.path}.part'
+            with open(part_path, 'w', encoding='utf-8') as f:
+                f.write(self.metrics.prometheus())
+            os.replace(part_path, self.path)
+
+    def close(self):
+        self.write()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+class Metrics:
+    """
+    Counters and histograms of the whole run (requests, retries, cache hits, pages, bytes and stage timings).
+    Values are always kept in memory, sinks receive every event as it happens and are closed when the process exits.
+    """
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.sinks = []
+        self.lock = threading.Lock()
+
+    def add_sink(self, sink):
+        with self.lock:
+            if not self.sinks:
+                atexit.register(self.close)
+            self.sinks.append(sink)
+
+    def count(self, name, value=1, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        self._emit('counter', name, value, labels)
+
+    def observe(self, name, value, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+        self._emit('histogram', name, value, labels)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observes the seconds spent in the block, also when it raises"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start, **labels)
+
+    def _emit(self, kind, name, value, labels):
+        if not self.sinks:
+            return
+        event = { 'time': round(time.time(), 3), 'type': kind, 'metric': name, 'value': value, 'labels': { label: str(label_value) for label, label_value in labels.items() } }
+        for sink in self.sinks:
+            sink.emit(event)
+
+    def prometheus(self) -> str:
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, (list(histogram.counts), histogram.sum, histogram.count, histogram.buckets)) for key, histogram in self.histograms.items())
+        typed = set()
+        for (name, labels), value in counters:
+            name = METRICS_PREFIX + name
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} counter')
+            lines.append(f'{name}{_format_labels(labels)} {value:g}')
+        for (name, labels), (counts, total, count, buckets) in histograms:
+            name = METRICS_PREFIX + name
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} histogram')
+            cumulative = 0
+            for bucket, bucket_count in zip(list(buckets) + ['+Inf'], counts):
+                cumulative += bucket_count
+                le = bucket if isinstance(bucket, str) else f'{bucket:g}'
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", le)])} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {total:g}')
+            lines.append(f'{name}_count{_format_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def close(self):
+        with self.lock:
+            sinks, self.sinks = self.sinks, []
+        for sink in sinks:
+            sink.close()
+
+METRICS = Metrics()
+
+def configure_metrics(args):
+    """Adds the sinks requested with --metrics-log, --metrics-prom and --metrics-port"""
+    if getattr(args, 'metrics_log', None):
+        METRICS.add_sink(JsonLinesSink(args.metrics_log))
+    if getattr(args, 'metrics_prom', None) or getattr(args, 'metrics_port', None):
+        METRICS.add_sink(PrometheusSink(METRICS, args.metrics_prom, args.metrics_port))
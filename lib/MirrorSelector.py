@@ -0,0 +1,85 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.Constants import MIRROR_COOLDOWN, MIRROR_FAILURES, MIRROR_PROBE_INTERVAL, MIRROR_PROBE_TIMEOUT
+
+class Mirror:
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.latency = None # seconds, moving average
+        self.error_rate = 0.0 # moving average
+        self.failures = 0
+        self.disabled_until = 0
+
+    def url(self, path):
+        return f'{self.base_url}/{path}'
+
+    def healthy(self, now):
+        return self.disabled_until <= now
+
+    def score(self):
+        """Expected seconds per successful request, lower is better"""
+        latency = self.latency if self.latency is not None else MIRROR_PROBE_TIMEOUT
+        return latency / max(0.05, 1 - self.error_rate)
+
+class MirrorSelector:
+    """
+    Tracks latency and error rate of the mirrors serving the same files and picks the fastest
+    healthy one for every request. Mirrors failing several times in a row are skipped for a cooldown.
+    """
+    ALPHA = 0.3
+
+    def __init__(self, base_urls):
+        self.mirrors = [Mirror(base_url) for base_url in base_urls]
+        self.probed = 0
+        self.lock = threading.Lock()
+
+    def probe(self, scraper, limiter=None):
+        """
+        Measure every mirror with a HEAD request, at most once every MIRROR_PROBE_INTERVAL.
+        limiter(url) is the rate limiter of the host of url, if any.
+        """
+        with self.lock:
+            if time.monotonic() - self.probed < MIRROR_PROBE_INTERVAL:
+                return
+            self.probed = time.monotonic()
+        def head(mirror):
+            if limiter is not None:
+                limiter(mirror.base_url).acquire()
+            start = time.monotonic()
+            try:
+                response = scraper.head(mirror.base_url, timeout=MIRROR_PROBE_TIMEOUT)
+                response.close()
+            except Exception:
+                self.record(mirror, False)
+                return
+            # a server error, a Cloudflare block (403) or throttling (429) means pages would fail there too
+            ok = response.status_code < 500 and response.status_code not in (403, 429)
+            self.record(mirror, ok, time.monotonic() - start)
+        with ThreadPoolExecutor(max_workers=len(self.mirrors)) as executor:
+            list(executor.map(head, self.mirrors))
+
+    def best(self, exclude=()):
+        with self.lock:
+            now = time.monotonic()
+            candidates = [mirror for mirror in self.mirrors if mirror not in exclude]
+            if not candidates:
+                return None
+            healthy = [mirror for mirror in candidates if mirror.healthy(now)]
+            if healthy:
+                return min(healthy, key=Mirror.score)
+            return min(candidates, key=lambda mirror: mirror.disabled_until) # all down, try the first to recover
+
+    def record(self, mirror, ok, elapsed=None):
+        with self.lock:
+            mirror.error_rate = (1 - self.ALPHA) * mirror.error_rate + self.ALPHA * (0 if ok else 1)
+            if ok:
+                mirror.failures = 0
+                mirror.disabled_until = 0
+                if elapsed is not None:
+                    mirror.latency = elapsed if mirror.latency is None else (1 - self.ALPHA) * mirror.latency + self.ALPHA * elapsed
+            else:
+                mirror.failures += 1
+                if mirror.failures >= MIRROR_FAILURES:
+                    mirror.disabled_until = time.monotonic() + MIRROR_COOLDOWN
@@ -0,0 +1,78 @@
+import hashlib
+import json
+import os
+import threading
+
+from lib.AtomicFile import replace_file
+from lib.Constants import MANIFEST_FILE
+
+def update_hash(sha256, path, chunk_size=1024 * 1024):
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256
+
+def file_hash(path):
+    return update_hash(hashlib.sha256(), path).hexdigest()
+
+class PageManifest:
+    """
+    Sizes and hashes of the pages downloaded for a chapter, stored in the chapter directory.
+    A chapter is complete when all its pages are listed and their files have the expected size.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = f'{directory}/{MANIFEST_FILE}'
+        self.lock = threading.Lock()
+        self.total = None
+        self.pages = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                manifest = json.load(f)
+            self.total = manifest.get('total')
+            self.pages = manifest.get('pages', {})
+        except (OSError, ValueError):
+            self.total = None
+            self.pages = {}
+
+    def save(self):
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with replace_file(self.path) as f:
+                json.dump({ 'total': self.total, 'pages': self.pages }, f, indent=1, sort_keys=True)
+
+    def set_total(self, total):
+        with self.lock:
+            self.total = total
+
+    def add(self, filename, size, sha256):
+        with self.lock:
+            self.pages[filename] = { 'size': size, 'sha256': sha256 }
+
+    def discard(self, filename):
+        with self.lock:
+            self.pages.pop(filename, None)
+
+    def has(self, filename):
+        page = self.pages.get(filename)
+        if page is None:
+            return False
+        try:
+            return os.path.getsize(f'{self.directory}/{filename}') == page['size']
+        except OSError:
+            return False
+
+    def is_complete(self):
+        return self.total is not None and len(self.pages) >= self.total and all(map(self.has, list(self.pages)))
+
+    def verify(self, filename):
+        """Check the page content against its stored hash"""
+        page = self.pages.get(filename)
+        return page is not None and self.has(filename) and file_hash(f'{self.directory}/{filename}') == page['sha256']
+
+    def corrupted(self):
+        """Pages listed in the manifest whose content does not match their hash"""
+        return sorted(filename for filename in list(self.pages) if not self.verify(filename))
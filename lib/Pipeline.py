@@ -0,0 +1,60 @@
+import queue
+import threading
+
+from lib.ArgsSingleService import ArgsSingleService
+from lib.Constants import PIPELINE_QUEUE_SIZE
+
+POLL_SECONDS = 1 # a producer waiting for room in the queue checks this often if the consumer stopped
+
+class ChapterPipeline:
+    """
+    Runs the download stage in a background thread and yields every chapter
+    as soon as it is on disk, so conversion overlaps with the next downloads.
+    The bounded queue stops downloads from getting too far ahead of conversion.
+    If the consumer stops early (an error, or the generator is closed) no more chapters are downloaded.
+    """
+    _DONE = object()
+
+    def __init__(self, download, maxsize=PIPELINE_QUEUE_SIZE):
+        self.download = download
+        self.queue = queue.Queue(maxsize=max(1, maxsize))
+        self.error = None
+        self.stopped = threading.Event()
+
+    def run(self, chapters):
+        producer = threading.Thread(target=ArgsSingleService.inherit(self._produce), args=(list(chapters),), daemon=True)
+        producer.start()
+        try:
+            while True:
+                chapter = self.queue.get()
+                if chapter is ChapterPipeline._DONE:
+                    break
+                yield chapter
+        finally: # also when the consumer stopped early, the producer exits after the chapter it is downloading
+            self.stopped.set()
+        producer.join()
+        if self.error is not None:
+            raise self.error
+
+    def _put(self, item):
+        """False once the consumer stopped"""
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=POLL_SECONDS)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self, chapters):
+        try:
+            for chapter in chapters:
+                if self.stopped.is_set():
+                    return
+                self.download(chapter)
+                if not self._put(chapter):
+                    return
+        except BaseException as e: # error() and network_error() exit, so SystemExit must reach the main thread too
+            self.error = e
+        finally:
+            self._put(ChapterPipeline._DONE)
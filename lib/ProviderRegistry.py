@@ -0,0 +1,15 @@
+import importlib
+
+# provider name (as in --batch watchlists) -> module and class, imported on first use
+PROVIDERS = {
+    'inmanga': ('lib.ConcreteMangas.InManga', 'InManga'),
+    'lectormanga': ('lib.ConcreteMangas.LectorManga', 'LectorManga'),
+}
+
+def provider(name):
+    module, class_name = PROVIDERS[name]
+    return getattr(importlib.import_module(module), class_name)
+
+def providers(names=None):
+    """Online provider classes, all of them or only the given names, in search order"""
+    return [provider(name) for name in PROVIDERS if not names or name in names]
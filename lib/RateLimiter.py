@@ -0,0 +1,98 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from lib.Constants import BACKOFF_BASE, BACKOFF_MAX, BREAKER_COOLDOWN, BREAKER_THRESHOLD, HOST_BURST, HOST_MIN_RATE, HOST_RATE
+
+def backoff(attempt):
+    """Exponential backoff with jitter, in seconds"""
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1)
+
+def retry_after(response):
+    """Seconds to wait from the Retry-After header, None if missing or invalid"""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return min(BACKOFF_MAX, max(0, float(value)))
+    except ValueError:
+        pass
+    try:
+        return min(BACKOFF_MAX, max(0, parsedate_to_datetime(value).timestamp() - time.time()))
+    except (TypeError, ValueError):
+        return None
+
+class TokenBucket:
+    """
+    Adaptive per-host rate limiter. The rate is halved every time the host answers
+    429 or 503 and grows back slowly with every successful request.
+    """
+    def __init__(self, rate=HOST_RATE, burst=HOST_BURST, min_rate=HOST_MIN_RATE):
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def throttled(self, wait=None):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+            if wait:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + wait)
+
+    def succeeded(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 50)
+
+class CircuitBreaker:
+    """
+    Pauses every request to a provider for a cooldown after consecutive failures,
+    instead of hammering it or exiting. After the cooldown requests are let through again
+    and the breaker opens again as soon as they keep failing.
+    """
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened = None
+        self.lock = threading.Lock()
+
+    def remaining(self):
+        with self.lock:
+            if self.opened is None:
+                return 0
+            return max(0, self.opened + self.cooldown - time.monotonic())
+
+    def wait(self):
+        remaining = self.remaining()
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def record(self, ok):
+        with self.lock:
+            if ok:
+                self.failures = 0
+                self.opened = None
+            else:
+                self.failures += 1
+                if self.failures >= self.threshold:
+                    self.opened = time.monotonic()
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from lib.AtomicFile import replace_file
+from lib.Constants import RESPONSE_CACHE_DIR, RESPONSE_CACHE_SIZE
+
+class CachedResponse:
+    """Stored provider response, exposing the attributes used from requests.Response"""
+    def __init__(self, url, status_code, content, headers=None):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+class ResponseCache:
+    """
+    On-disk cache for provider metadata responses (search results and chapter listings).
+    Entries are keyed by provider and request, expire after a TTL and are revalidated with
+    ETag / Last-Modified when available. The least recently used entries are evicted
+    when the cache grows over max_size bytes.
+    """
+    def __init__(self, directory=RESPONSE_CACHE_DIR, max_size=RESPONSE_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(provider, method, url, data=None):
+        request = json.dumps([provider, method.upper(), url, data], sort_keys=True, default=str)
+        return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            meta = self._read_meta(key)
+            if meta is None:
+                return None, None
+            try:
+                with open(self._body_path(key), 'rb') as f:
+                    content = f.read()
+            except OSError:
+                return None, None
+            meta['accessed'] = time.time()
+            self._write_meta(key, meta)
+            return meta, CachedResponse(meta['url'], meta['status_code'], content, meta.get('headers'))
+
+    def put(self, key, response):
+        headers = {header: response.headers[header] for header in ('ETag', 'Last-Modified') if header in response.headers}
+        now = time.time()
+        meta = {
+            'url': response.url,
+            'status_code': response.status_code,
+            'headers': headers,
+            'size': len(response.content),
+            'stored': now,
+            'accessed': now
+        }
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            body_path = self._body_path(key)
+            with replace_file(body_path, 'wb') as f:
+                f.write(response.content)
+            self._write_meta(key, meta)
+            self._evict()
+
+    def revalidated(self, key):
+        """Response has not changed (304), so its TTL starts again"""
+        with self.lock:
+            meta = self._read_meta(key)
+            if meta is not None:
+                meta['stored'] = meta['accessed'] = time.time()
+                self._write_meta(key, meta)
+
+    @staticmethod
+    def is_fresh(meta, ttl):
+        return time.time() - meta['stored'] < ttl
+
+    @staticmethod
+    def validators(meta):
+        headers = {}
+        if 'ETag' in meta['headers']:
+            headers['If-None-Match'] = meta['headers']['ETag']
+        if 'Last-Modified' in meta['headers']:
+            headers['If-Modified-Since'] = meta['headers']['Last-Modified']
+        return headers
+
+    def _evict(self):
+        entries = []
+        for file in os.listdir(self.directory):
+            if file.endswith('.json'):
+                key = file[:-len('.json')]
+                meta = self._read_meta(key)
+                if meta is not None:
+                    entries.append((meta['accessed'], meta['size'], key))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            for path in (self._meta_path(key), self._body_path(key)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total_size -= size
+
+    def _meta_path(self, key):
+        return f'{self.directory}/{key}.json'
+
+    def _body_path(self, key):
+        return f'{self.directory}/{key}.body'
+
+    def _read_meta(self, key):
+        try:
+            with open(self._meta_path(key), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, key, meta):
+        path = self._meta_path(key)
+        with replace_file(path) as f:
+            json.dump(meta, f)
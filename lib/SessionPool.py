@@ -0,0 +1,112 @@
+import atexit
+import json
+import os
+import threading
+import time
+
+import cloudscraper
+
+from lib.AtomicFile import replace_file
+from lib.Constants import POOL_CONNECTIONS, POOL_SIZE, SESSION_TTL, SESSIONS_DIR
+
+class SessionPool:
+    """
+    Cloudscraper sessions shared by every instance of a provider, so solved challenges and
+    keep-alive connections are reused between chapters. Clearance cookies and the user agent
+    they were issued to are saved to disk and reused by later runs until they expire.
+    """
+    _sessions = {}
+    _saved_cookies = {}
+    _lock = threading.Lock()
+    _save_at_exit = False
+
+    @staticmethod
+    def get(provider, pool_sizes=None, **options):
+        with SessionPool._lock:
+            if not SessionPool._save_at_exit: # cookies set by page responses are saved once, when the run ends
+                atexit.register(SessionPool.save_all)
+                SessionPool._save_at_exit = True
+            if provider not in SessionPool._sessions:
+                scraper = SessionPool._create(pool_sizes, **options)
+                SessionPool._load(provider, scraper)
+                SessionPool._sessions[provider] = scraper
+            return SessionPool._sessions[provider]
+
+    @staticmethod
+    def renew(provider, stale_scraper=None, pool_sizes=None, **options):
+        """New session for the provider, unless another thread already replaced the stale one"""
+        with SessionPool._lock:
+            current = SessionPool._sessions.get(provider)
+            if current is None or stale_scraper is None or current is stale_scraper:
+                current = SessionPool._sessions[provider] = SessionPool._create(pool_sizes, **options)
+                SessionPool._saved_cookies.pop(provider, None)
+                try:
+                    os.remove(SessionPool._path(provider))
+                except OSError:
+                    pass
+            return current
+
+    @staticmethod
+    def save(provider):
+        """Save the session cookies if they changed since they were loaded or saved"""
+        with SessionPool._lock:
+            scraper = SessionPool._sessions.get(provider)
+            if scraper is None:
+                return
+            cookies = [{
+                'name': cookie.name,
+                'value': cookie.value,
+                'domain': cookie.domain,
+                'path': cookie.path,
+                'expires': cookie.expires,
+                'secure': cookie.secure
+            } for cookie in scraper.cookies]
+            if cookies == SessionPool._saved_cookies.get(provider):
+                return
+            SessionPool._saved_cookies[provider] = cookies
+            session = { 'user_agent': scraper.headers.get('User-Agent'), 'cookies': cookies, 'saved': time.time() }
+            path = SessionPool._path(provider)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with replace_file(path) as f:
+                json.dump(session, f)
+
+    @staticmethod
+    def save_all():
+        for provider in list(SessionPool._sessions):
+            try:
+                SessionPool.save(provider)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _create(pool_sizes=None, **options):
+        scraper = cloudscraper.create_scraper(**options)
+        https = scraper.get_adapter('https://')
+        def adapter(size):
+            # same TLS context as the cloudscraper adapter, so the browser fingerprint is kept
+            return cloudscraper.CipherSuiteAdapter(ssl_context=https.ssl_context, source_address=https.source_address, pool_connections=POOL_CONNECTIONS, pool_maxsize=size)
+        scraper.mount('https://', adapter(POOL_SIZE))
+        for host, size in (pool_sizes or {}).items():
+            scraper.mount(f'https://{host}/', adapter(size))
+        return scraper
+
+    @staticmethod
+    def _load(provider, scraper):
+        try:
+            with open(SessionPool._path(provider), 'r') as f:
+                session = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        if now - session.get('saved', 0) > SESSION_TTL:
+            return
+        cookies = [cookie for cookie in session.get('cookies', []) if not cookie.get('expires') or cookie['expires'] > now]
+        for cookie in cookies:
+            scraper.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'], path=cookie['path'], expires=cookie['expires'], secure=cookie['secure'])
+        if session.get('user_agent'): # clearance cookies are only valid with the same user agent
+            scraper.headers['User-Agent'] = session['user_agent']
+        SessionPool._saved_cookies[provider] = cookies
+
+    @staticmethod
+    def _path(provider):
+        return f'{SESSIONS_DIR}/{provider}.json'
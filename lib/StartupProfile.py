@@ -0,0 +1,37 @@
+import builtins
+import sys
+import time
+
+START = time.perf_counter()
+_marks = [] # (label, time) of the startup phases
+_imports = {} # module -> seconds of its first import, including the modules it imports
+_import = builtins.__import__
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level or name in sys.modules:
+        return _import(name, globals, locals, fromlist, level)
+    start = time.perf_counter()
+    try:
+        return _import(name, globals, locals, fromlist, level)
+    finally:
+        _imports.setdefault(name, time.perf_counter() - start)
+
+def profile_imports():
+    """Time every module imported from now on"""
+    builtins.__import__ = _timed_import
+
+def mark(label):
+    _marks.append((label, time.perf_counter()))
+
+def report_startup(limit=15):
+    builtins.__import__ = _import
+    now = time.perf_counter()
+    print(f'Startup: {(now - START) * 1000:.1f} ms')
+    previous = START
+    for label, at in _marks:
+        print(f'  {label:<30} {(at - previous) * 1000:8.1f} ms')
+        previous = at
+    print('Slowest imports (including the modules they import)')
+    for name, seconds in sorted(_imports.items(), key=lambda item: item[1], reverse=True)[:limit]:
+        print(f'  {name:<30} {seconds * 1000:8.1f} ms')
+    print(f'Modules loaded: {len(sys.modules)}')
@@ -0,0 +1,136 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from lib.Constants import SHARD_ATTEMPTS, SHARD_LEASE_SECONDS, WORK_QUEUE_FILE
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+class WorkQueue:
+    """
+    Chapters to download (--shard), shared through SQLite in the manga directory by the worker processes
+    of this host and of any host that mounts it. A worker leases one chapter at a time and renews the
+    lease while it downloads, so the chapters of a worker that dies are handed out again once its lease
+    expires. Failed chapters are retried up to attempts times, by any worker.
+    The file system must support locks (a local disk, or NFS/SMB with locking enabled).
+    """
+    def __init__(self, path=WORK_QUEUE_FILE, lease_seconds=SHARD_LEASE_SECONDS, attempts=SHARD_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.attempts = attempts
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None) # transactions are explicit
+        self.connection.row_factory = sqlite3.Row
+        with self.lock:
+            self.connection.executescript('''
+                CREATE TABLE IF NOT EXISTS units (id INTEGER PRIMARY KEY AUTOINCREMENT, provider TEXT, manga TEXT, title TEXT, chapter REAL, status TEXT, worker TEXT, lease REAL, attempts INTEGER DEFAULT 0, error TEXT, UNIQUE (provider, manga, chapter));
+                CREATE INDEX IF NOT EXISTS units_status ON units (status);
+            ''')
+
+    def close(self):
+        self.connection.close()
+
+    def _transaction(self, work):
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE') # other processes wait, a lease is never given twice
+            try:
+                result = work(self.connection)
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+            self.connection.execute('COMMIT')
+            return result
+
+    def add(self, provider, manga, title, chapters):
+        """Queue the chapters of the series again, the ones already queued or leased are left as they are"""
+        def add(connection):
+            for chapter in chapters:
+                connection.execute('INSERT OR IGNORE INTO units (provider, manga, title, chapter, status) VALUES (?, ?, ?, ?, ?)', (provider, manga, title, chapter, PENDING))
+                connection.execute('UPDATE units SET status = ?, attempts = 0, error = NULL WHERE provider = ? AND manga = ? AND chapter = ? AND status IN (?, ?)',
+                                   (PENDING, provider, manga, chapter, DONE, FAILED))
+        self._transaction(add)
+
+    def lease(self, worker):
+        """Next pending chapter, or one whose lease expired, or None. Expired chapters without attempts left fail"""
+        def lease(connection):
+            now = time.time()
+            connection.execute('UPDATE units SET status = ?, lease = NULL, error = ? WHERE status = ? AND lease < ? AND attempts >= ?',
+                               (FAILED, 'The workers downloading it stopped', LEASED, now, self.attempts)) # it may be the chapter that crashes them
+            row = connection.execute('SELECT * FROM units WHERE status = ? OR (status = ? AND lease < ?) ORDER BY id LIMIT 1', (PENDING, LEASED, now)).fetchone()
+            if row is None:
+                return None
+            connection.execute('UPDATE units SET status = ?, worker = ?, lease = ?, attempts = attempts + 1 WHERE id = ?', (LEASED, worker, now + self.lease_seconds, row['id']))
+            return dict(row, worker=worker)
+        return self._transaction(lease)
+
+    def renew(self, unit):
+        """False when the lease was lost (it expired and another worker took the chapter)"""
+        def renew(connection):
+            return connection.execute('UPDATE units SET lease = ? WHERE id = ? AND status = ? AND worker = ?',
+                                      (time.time() + self.lease_seconds, unit['id'], LEASED, unit['worker'])).rowcount == 1
+        return self._transaction(renew)
+
+    @contextmanager
+    def leased(self, unit):
+        """Renew the lease of the unit in the background while it is processed. Yields an event set once the lease is lost"""
+        done = threading.Event()
+        lost = threading.Event()
+        def keep():
+            while not done.wait(self.lease_seconds / 4):
+                if not self.renew(unit):
+                    lost.set()
+                    return
+        thread = threading.Thread(target=keep, daemon=True)
+        thread.start()
+        try:
+            yield lost
+        finally:
+            done.set()
+            thread.join()
+
+    def finish(self, unit, error=None):
+        """Done without error, otherwise pending again until the attempts run out. Returns the new status, None if the lease was lost"""
+        def finish(connection):
+            row = connection.execute('SELECT attempts FROM units WHERE id = ? AND status = ? AND worker = ?', (unit['id'], LEASED, unit['worker'])).fetchone()
+            if row is None: # taken by another worker after the lease expired, or failed for running out of attempts
+                return None
+            status = DONE if error is None else (FAILED if row['attempts'] >= self.attempts else PENDING)
+            updated = connection.execute('UPDATE units SET status = ?, lease = NULL, error = ? WHERE id = ? AND status = ? AND worker = ?',
+                                         (status, error, unit['id'], LEASED, unit['worker'])).rowcount
+            return status if updated == 1 else None
+        return self._transaction(finish)
+
+    @staticmethod
+    def _chapters(chapters):
+        """SQL condition and parameters of the units of these chapters, all of them when None"""
+        if chapters is None:
+            return '', ()
+        return f" AND chapter IN ({', '.join('?' * len(chapters))})", tuple(chapters)
+
+    def progress(self, provider=None, manga=None, chapters=None):
+        """Units by status, of one series (only these chapters, if given) or of the whole queue"""
+        with self.lock:
+            if provider is None:
+                rows = self.connection.execute('SELECT status, count(*) FROM units GROUP BY status').fetchall()
+            else:
+                condition, parameters = self._chapters(chapters)
+                rows = self.connection.execute(f'SELECT status, count(*) FROM units WHERE provider = ? AND manga = ?{condition} GROUP BY status', (provider, manga) + parameters).fetchall()
+        progress = { PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0 }
+        progress.update({ status: count for status, count in rows })
+        return progress
+
+    def failed(self, provider, manga, chapters=None):
+        """(chapter, error) of the chapters that ran out of attempts"""
+        condition, parameters = self._chapters(chapters)
+        with self.lock:
+            return self.connection.execute(f'SELECT chapter, error FROM units WHERE provider = ? AND manga = ? AND status = ?{condition} ORDER BY chapter', (provider, manga, FAILED) + parameters).fetchall()
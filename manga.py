@@ -1,23 +1,56 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
+import sys
+from lib.Constants import SUPPORT_PYTHON
+if sys.version_info < SUPPORT_PYTHON[0]: # the standard library and the pinned dependencies need it
+  sys.exit(f"Python {'.'.join(map(str, SUPPORT_PYTHON[0]))} or newer is needed, this is Python {sys.version.split()[0]}")
+from lib.StartupProfile import mark, profile_imports, report_startup
+if '--profile-startup' in sys.argv: # before anything else is imported
+  profile_imports()
+
 from lib.ArgsSingleService import ArgsSingleService, set_args
+import argparse
+import json
 import os
-import sys
+import queue
 import tempfile
+import threading
+import time
 import subprocess
+from concurrent.futures import Future
+from contextlib import closing
 from multiprocessing import freeze_support
 from lib.CheckVersion import CheckVersion
 from lib.Common import *
+from lib.AbstractMangas.MangaTemplate import MangaTemplate
+from lib.BlobStore import BlobStore
+from lib.ConversionCache import ConversionCache
 from lib.ConcreteMangas.LocalManga import LocalManga
-from lib.AbstractMangas.OnlineMangaTemplate import OnlineMangaTemplate
+from lib.FollowState import FollowState
+from lib.FuzzySearch import similarity
+from lib.MangaService import MangaService
+from lib.Metrics import METRICS, configure_metrics
+from lib.PageManifest import PageManifest
+from lib.Pipeline import ChapterPipeline
+from lib.ProviderRegistry import providers as online_providers
+from lib.WorkQueue import WorkQueue, worker_name
 from lib.results.manga_class import Manga
+mark('imports')
 
 def install_dependencies(dependencies_file):
-  # Check dependencies
+  # Check dependencies, only when they changed since the last successful check
   from pathlib import Path
-  import pkg_resources
+  import hashlib
   dependencies_path = Path(__file__).with_name(dependencies_file)
+  stamp_path = Path(__file__).with_name(DEPENDENCIES_STAMP)
+  stamp = hashlib.sha256(dependencies_path.read_bytes() + sys.executable.encode() + sys.version.encode()).hexdigest()
+  try:
+    if stamp_path.read_text() == stamp:
+      return
+  except OSError:
+    pass
+  import pkg_resources
   dependencies = pkg_resources.parse_requirements(dependencies_path.open())
   try:
     for dependency in dependencies:
@@ -27,78 +60,331 @@ def install_dependencies(dependencies_file):
     print("Some dependencies are missing, installing...")
     # Install missing dependencies
     subprocess.check_call([sys.executable, "-m", "pip", "install", "-r", dependencies_file])
+  try:
+    stamp_path.write_text(stamp)
+  except OSError: # read-only installation, checked in every run
+    pass
 
 install_dependencies("dependencies.txt")
+mark('dependency check')
 
-
-from lib.AbstractMangas.MangaTemplate import MangaTemplate
-from lib.ConcreteMangas.InManga import InManga
-from lib.ConcreteMangas.LectorManga import LectorManga
-from lib.ConcreteMangas.HentaiFox import HentaiFox
 from colorama import Fore, Style, init as init_console_colors
 
 
-def create_manga_service_and_search_online(title) -> List[OnlineMangaTemplate]:
-  results = []
-  for subclass in OnlineMangaTemplate.__subclasses__():
-    manga_class = subclass()
-    manga_class.base_search(title)
-    if manga_class.search_results: results.append(manga_class)
-  if not results: not_found(title)
+def create_manga_service_and_search_online(title, instances=None, providers=None) -> List[MangaTemplate]:
+  # every provider is searched at the same time, a slow or broken provider does not block the others
+  subclasses = online_providers(providers) # provider modules are imported on first use
+  instances = instances if instances is not None else {}
+  searches = queue.Queue()
+
+  def search(subclass):
+    try:
+      manga_class = instances.get(subclass)
+      if manga_class is None:
+        manga_class = instances[subclass] = subclass()
+      else: # scraper session is reused
+        manga_class.reset()
+      manga_class.base_search(title)
+      searches.put((subclass, manga_class, None))
+    except BaseException as e: # providers exit on network errors
+      searches.put((subclass, None, e))
+
+  for subclass in subclasses:
+    threading.Thread(target=ArgsSingleService.inherit(search), args=(subclass,), daemon=True).start()
+
+  services = {}
+  pending = set(subclasses)
+  deadline = time.monotonic() + SEARCH_TIMEOUT
+  while pending:
+    try:
+      subclass, manga_class, e = searches.get(timeout=max(0, deadline - time.monotonic()))
+    except queue.Empty:
+      print_colored(f"Search timed out in {', '.join(sorted(subclass.__name__ for subclass in pending))}", Fore.RED)
+      break
+    pending.discard(subclass)
+    if e is not None:
+      print_colored(f"Search failed in '{subclass.__name__}'", Fore.RED)
+    elif manga_class.search_results:
+      services[subclass] = manga_class
+
+  results = [services[subclass] for subclass in subclasses if subclass in services]
+  with closing(LocalManga().library()) as library:
+    for manga_service in results:
+      library.remember(manga_service.name, manga_service.search_results)
+  if not results:
+    not_found(title)
+    suggest_titles(title)
   return results
 
-def title_selection(manga_services) -> MangaTemplate:
-  option = 0
-  for manga_service in manga_services:
-    for title in manga_service.search_results:
-      print(f"[{option}] {manga_service.name} - {title.title}")
-      option += 1
+def suggest_titles(title):
+  """Titles similar to the one not found, from earlier provider searches"""
+  with closing(LocalManga().library()) as library:
+    suggestions = library.found_titles().search(title, limit=TITLE_SUGGESTIONS)
+  if suggestions:
+    print_dim(f"Similar titles found before: {', '.join(suggestion for _, suggestion in suggestions)}")
+
+def title_selection(manga_services, title='') -> MangaTemplate:
+  options = [(manga_service, manga) for manga_service in manga_services for manga in manga_service.search_results]
+  if title: # best matches first
+    options.sort(key=lambda option: similarity(title, option[1].title), reverse=True)
+  library = None
+  if any(not isinstance(manga_service, LocalManga) for manga_service in manga_services):
+    with closing(LocalManga().library()) as index:
+      library = index.titles()
+  for option, (manga_service, manga) in enumerate(options):
+    downloaded = library.search(manga.title, limit=1, threshold=LIBRARY_MATCH_THRESHOLD) if library else None
+    in_library = f" (in library: {downloaded[0][1]})" if downloaded else ''
+    print(f"[{option}] {manga_service.name} - {manga.title}{in_library}")
   selection = int(input("Select title: "))
-  for manga_service in manga_services:
-    if selection > len(manga_service.search_results):
-      selection -= len(manga_service.search_results)
-      continue
-    else:
-      manga_service.current_manga = manga_service.search_results[selection]
-      return manga_service
+  manga_service, manga = options[selection]
+  manga_service.current_manga = manga
+  return manga_service
+
+def batch_selection(entry, manga_services) -> MangaTemplate:
+  candidates = [(manga_service, manga) for manga_service in manga_services for manga in manga_service.search_results if not entry.get('id') or manga.uuid == str(entry['id'])]
+  if not candidates:
+    error(f"'{entry['title']}' not found" + (f" with id {entry['id']}" if entry.get('id') else ''))
+  candidates.sort(key=lambda candidate: similarity(entry['title'], candidate[1].title), reverse=True)
+  manga_service, manga = candidates[0]
+  if not entry.get('id') and similarity(entry['title'], manga.title) < LIBRARY_MATCH_THRESHOLD: # never another series
+    closest = '\n'.join(f"{candidate.title} (provider {service.name}, id {candidate.uuid})" for service, candidate in candidates[:TITLE_SUGGESTIONS])
+    error(f"'{entry['title']}' not found, add the 'id' of the series to the entry", f'Closest results:\n{closest}')
+  manga_service.current_manga = manga
+  return manga_service
+
+def downloaded(instances):
+  return sum(service.downloaded_pages for service in instances.values()), sum(service.downloaded_bytes for service in instances.values())
+
+def job_args(entry, args):
+  """Arguments of a watchlist entry or a --serve job, its options over the command line ones"""
+  entry_args = argparse.Namespace(**vars(args))
+  for option in BATCH_OPTIONS:
+    if option in entry:
+      setattr(entry_args, option, entry[option])
+  if isinstance(entry_args.chapters, str):
+    entry_args.chapters = [entry_args.chapters]
+  return entry_args
+
+def search_entry(entry, entry_args, instances) -> MangaTemplate:
+  if entry_args.cache: # offline search
+    manga_service = LocalManga()
+    manga_service.base_search(entry['title'])
+    manga_services = [manga_service]
+  else: # online search
+    providers = [entry['provider'].lower()] if entry.get('provider') else None
+    manga_services = create_manga_service_and_search_online(entry['title'], instances, providers)
+  return batch_selection(entry, manga_services)
+
+def batch(watchlist_path, args):
+  """Process every series in the watchlist in this process, sharing the provider scraper sessions"""
+  try:
+    with open(watchlist_path, 'r', encoding='utf-8') as f:
+      watchlist = json.load(f)
+  except (OSError, ValueError) as e:
+    error(f'Cannot read watchlist {watchlist_path}', str(e))
 
-if __name__ == "__main__":
-  cancellable()
-  freeze_support()
-  init_console_colors()
-  
-  # PARSE ARGS
   ass = ArgsSingleService()
-  ass.args = set_args(CheckVersion)
-  args = ass.args
+  instances = {}
+  summary = []
 
-  check_version()
+  for entry in watchlist:
+    if isinstance(entry, str):
+      entry = { 'title': entry }
+    title = entry.get('title') if isinstance(entry, dict) else None
 
-  MANGA_DIR = strip_path(args.directory, DIRECTORY_KEEP)
+    print_colored(f"\n{title or entry}", Fore.MAGENTA, Style.BRIGHT)
+    downloaded_pages, downloaded_bytes = downloaded(instances)
+    start = time.monotonic()
+    chapters = []
+    status = 'OK'
+    try: # a failing series does not stop the batch, Ctrl+C does
+      if not isinstance(title, str) or not title.strip():
+        error(f'Watchlist entries need a title: {entry}')
+      entry_args = ass.args = job_args(entry, args)
+      manga_service = search_entry(entry, entry_args, instances)
+      chapters = download_and_convert(manga_service, entry_args)
+    except ErrorExit:
+      status = 'FAILED'
+    except Exception as e:
+      print_colored(f'{type(e).__name__}: {e}', Fore.RED)
+      status = 'FAILED'
+    elapsed = time.monotonic() - start
+    pages, size = downloaded(instances)
+    pages -= downloaded_pages
+    size = (size - downloaded_bytes) / (1024 * 1024)
+    summary.append((title or str(entry), status, len(chapters), pages, size, elapsed))
 
-  if not args.profile:
-    args.profile = 'KPW'
+  ass.args = args
+  print_colored('\nBatch summary', Fore.BLUE, Style.BRIGHT)
+  for title, status, chapters, pages, size, elapsed in summary:
+    color = Fore.GREEN if status == 'OK' else Fore.RED
+    rate = f' ({pages / elapsed:.2f} pages/s, {size / elapsed:.2f} MB/s)' if elapsed > 0 else ''
+    print_colored(f'[{status}] {title}: {chapters} chapter{plural(chapters)}, {pages} page{plural(pages)}, {size:.1f} MB in {elapsed:.1f}s{rate}', color)
 
-  MANGA = ' '.join(args.manga)
+def library_manga(title) -> LocalManga:
+  """Downloaded series in the library, by the title it was downloaded with"""
+  manga_service = LocalManga()
+  manga_service.current_manga = Manga()
+  manga_service.current_manga.title = title
+  manga_service.current_manga.path = os.path.abspath(manga_directory(title))
+  return manga_service
 
-  search_type = f'in {MANGA_DIR}' if args.cache else 'online'
+def shard(manga_service, args, spawn_worker=None) -> List[float]:
+  """
+  Queue the chapters in the WorkQueue of the manga directory and wait until the --worker processes,
+  of this host (--local-workers) or of any host sharing the manga directory, download them.
+  Then convert them here as usual. spawn_worker(n) starts a local worker process.
+  """
+  CHAPTERS, follow_state = select_chapters(manga_service, args)
+  if not CHAPTERS:
+    return []
+  title = manga_service.current_manga.title
+  manga_id = str(manga_service.current_manga.uuid)
+  pending = [chapter for chapter in CHAPTERS if not PageManifest(chapter_directory(title, chapter)).is_complete()]
+  work_queue = WorkQueue()
+  work_queue.add(manga_service.name, manga_id, title, pending)
+  print_dim(f'{len(pending)} chapter{plural(len(pending))} queued in {work_queue.path}' + (f', {len(CHAPTERS) - len(pending)} already downloaded' if len(pending) < len(CHAPTERS) else ''))
+  spawn_worker = spawn_worker or (lambda n: local_worker(args, n))
+  processes = [spawn_worker(n) for n in range(args.local_workers)] if pending else []
+  if pending and not processes:
+    print_dim(f'Start the workers with: manga.py --worker (from the directory containing {MANGA_DIR})')
+  start = time.monotonic()
+  try:
+    shown = None
+    while True:
+      progress = work_queue.progress(manga_service.name, manga_id, pending) # not the chapters queued by earlier runs
+      if progress != shown:
+        shown = progress
+        print_colored(f"{progress['done']}/{len(pending)} chapters downloaded, {progress['leased']} downloading, {progress['failed']} failed", Fore.YELLOW)
+      if not progress['pending'] and not progress['leased']:
+        break
+      if processes and all(process.poll() is not None for process in processes):
+        error('All the local workers exited before downloading every chapter', f'See their output in {CACHE_DIR}/worker-*.log')
+      time.sleep(SHARD_POLL_SECONDS)
+  finally:
+    for process in processes:
+      if process.poll() is None:
+        process.terminate()
+  elapsed = time.monotonic() - start
+  for chapter, reason in work_queue.failed(manga_service.name, manga_id, pending):
+    print_colored(f'Chapter {chapter:g} failed: {reason}', Fore.RED)
+  complete = [chapter for chapter in CHAPTERS if PageManifest(chapter_directory(title, chapter)).is_complete()]
+  if pending:
+    print_colored(f'{len(pending)} chapter{plural(len(pending))} downloaded by the workers in {elapsed:.1f}s', Fore.GREEN, Style.BRIGHT)
+  if follow_state is not None: # chapters with missing pages are retried in the next run
+    follow_state.update(manga_service, complete)
+    follow_state.save()
+  if not complete:
+    error('No chapter could be downloaded')
+  library_args = argparse.Namespace(**vars(args))
+  library_args.cache = True
+  library_args.follow = False
+  library_args.batch = True # chapters that failed are skipped without asking
+  library_args.chapters = [', '.join(f'{chapter:g}' for chapter in complete)]
+  with ArgsSingleService.thread_args(library_args):
+    with closing(library_manga(title)) as local_manga:
+      download_and_convert(local_manga, library_args)
+  return complete
 
-  manga_service = None
-  if args.cache: # offline search
-    manga_service = LocalManga()
-    manga_service.base_search(MANGA)
-    manga_service = title_selection([manga_service])
-  else: # online search
-    manga_services = create_manga_service_and_search_online(MANGA)
-    manga_service = title_selection(manga_services)
+def local_worker(args, n):
+  """--worker process of this host, with the download options of this run"""
+  argv = [sys.executable, os.path.abspath(__file__), '--worker']
+  for option in ('threads', 'chunk_size', 'pool_size'):
+    if getattr(args, option, None) is not None:
+      argv += [f"--{option.replace('_', '-')}", str(getattr(args, option))]
+  for option in ('http2', 'refresh'):
+    if getattr(args, option, False):
+      argv.append(f"--{option.replace('_', '-')}")
+  os.makedirs(CACHE_DIR, exist_ok=True)
+  with open(f'{CACHE_DIR}/worker-{n}.log', 'w', encoding='utf-8') as log:
+    return subprocess.Popen(argv, stdout=log, stderr=subprocess.STDOUT)
+
+def shard_worker(args):
+  """--worker: download the chapters queued by --shard until there are none left"""
+  work_queue = WorkQueue()
+  worker = worker_name()
+  services = {} # series already searched by this worker
+  idle_since = time.monotonic()
+  processed = 0
+  print_colored(f'Worker {worker} waiting for chapters in {work_queue.path}', Fore.BLUE, Style.BRIGHT)
+  while True:
+    unit = work_queue.lease(worker)
+    if unit is None:
+      progress = work_queue.progress()
+      if not progress['pending'] and not progress['leased'] and (processed or time.monotonic() - idle_since > SHARD_IDLE_SECONDS):
+        break
+      time.sleep(SHARD_POLL_SECONDS)
+      continue
+    error_message = None
+    with work_queue.leased(unit) as lost:
+      try:
+        key = (unit['provider'], unit['manga'])
+        manga_service = services.get(key)
+        if manga_service is None:
+          entry = { 'title': unit['title'], 'provider': unit['provider'], 'id': unit['manga'] }
+          manga_service = services[key] = search_entry(entry, args, {})
+          manga_service.get_chapters()
+        chapter = unit['chapter']
+        if chapter not in manga_service.current_manga.chapters:
+          error(f"Chapter {chapter:g} of '{unit['title']}' not found")
+        print_colored(f"Downloading {unit['title']} {chapter:g}", Fore.YELLOW, Style.BRIGHT)
+        manga_service.cancelled = lost.is_set # another worker may be downloading it now
+        manga_service.get_pages(chapter)
+        if not PageManifest(chapter_directory(manga_service.current_manga.title, chapter)).is_complete():
+          error_message = 'Some pages could not be downloaded'
+      except ErrorExit as e: # a failing chapter does not stop the worker, Ctrl+C does
+        error_message = e.message or 'Failed'
+      except Exception as e:
+        print_colored(f'{type(e).__name__}: {e}', Fore.RED)
+        error_message = f'{type(e).__name__}: {e}'
+    if lost.is_set():
+      error_message = 'The lease was lost'
+    status = work_queue.finish(unit, error_message)
+    METRICS.count('shard_units_total', status=status or 'lost')
+    print_colored(f"{unit['title']} {unit['chapter']:g}: {status or 'lease lost'}" + (f' ({error_message})' if error_message else ''), Fore.GREEN if status == 'done' else Fore.RED)
+    processed += 1
+    idle_since = time.monotonic()
+  print_colored(f'Worker {worker} finished, {processed} chapter{plural(processed)} processed', Fore.GREEN, Style.BRIGHT)
+
+def serve(args):
+  """Process the jobs submitted to the localhost API: download to PNG first, then convert from the library"""
+  providers = threading.local() # scraper sessions of every download worker
+
+  def download(request, cancelled, series_lock):
+    entry_args = job_args(request, args)
+    convert = entry_args.format.upper() != 'PNG'
+    entry_args.format = 'PNG'
+    entry_args.batch = True # never asks
+    with ArgsSingleService.thread_args(entry_args):
+      manga_service = search_entry(request, entry_args, providers.__dict__.setdefault('instances', {}))
+      title = manga_service.current_manga.title
+      with series_lock(title):
+        chapters = download_and_convert(manga_service, entry_args, cancelled)
+    return { 'title': title, 'chapters': chapters }, convert and bool(chapters)
+
+  def convert(request, result, cancelled, series_lock):
+    entry_args = job_args(request, args)
+    entry_args.cache = True # from the chapters downloaded by the job
+    entry_args.follow = False
+    entry_args.chapters = [', '.join(f'{chapter:g}' for chapter in result['chapters'])]
+    entry_args.batch = True
+    with ArgsSingleService.thread_args(entry_args), series_lock(result['title']):
+      with closing(library_manga(result['title'])) as local_manga:
+        download_and_convert(local_manga, entry_args, cancelled)
+    return result
+
+  MangaService(download, convert, args.serve, args.download_jobs, args.convert_jobs).serve_forever()
+
+def select_chapters(manga_service, args):
+  """(chapters requested by args, FollowState or None), no chapters when following and there are no new ones"""
+  search_type = f'in {strip_path(args.directory, DIRECTORY_KEEP)}' if args.cache else 'online'
 
   print_colored(manga_service.current_manga.title, Fore.BLUE)
 
   # RETRIEVE CHAPTERS
 
-  directory = os.path.abspath(manga_directory(manga_service.current_manga.title))
-
-  ALL_CHAPTERS = manga_service.get_chapters()
+  with METRICS.timer('stage_seconds', stage='chapters', provider=manga_service.name):
+    ALL_CHAPTERS = manga_service.get_chapters()
 
   if not ALL_CHAPTERS:
     error(f"There are no chapters of '{manga_service.current_manga.title}' available {search_type}")
@@ -111,6 +397,17 @@ if __name__ == "__main__":
 
   CHAPTERS, chapters_not_found_intervals = chapters_in_intervals(ALL_CHAPTERS, CHAPTER_INTERVALS)
 
+  follow_state = None
+  if args.follow: # only chapters not seen in previous runs
+    follow_state = FollowState(os.path.abspath(manga_directory(manga_service.current_manga.title)))
+    if not follow_state.follows(manga_service):
+      print_colored(f'{manga_service.current_manga.title} was followed in {follow_state.provider} (id {follow_state.uuid}), now in {manga_service.name} (id {manga_service.current_manga.uuid}). Every chapter is new again', Fore.YELLOW, Style.BRIGHT)
+      follow_state.reset()
+    CHAPTERS = follow_state.new_chapters(manga_service, CHAPTERS)
+    if not CHAPTERS:
+      print_colored(f'No new chapters of {manga_service.current_manga.title}', Fore.GREEN, Style.BRIGHT)
+      return [], follow_state
+
   if args.cache:
     print_colored(f'Last downloaded chapter: {last:g}', Fore.YELLOW, Style.BRIGHT)
   else:
@@ -122,20 +419,38 @@ if __name__ == "__main__":
     print_colored(f'The following chapters {not_found}: {chapters_not_found_intervals}', Fore.RED, Style.BRIGHT)
     if args.cache:
       error(f'Please download those chapters first.', 'Try again this command without --cache')
-    else:
+    elif not args.follow and not args.batch:
       print_colored('🖐️  Press enter to continue without those chapters or Ctrl+C to abort...', Fore.MAGENTA, Style.BRIGHT, end=' ')
       input()
   
   if not CHAPTERS:
     error("No chapters found")
 
-  if not args.cache:
-    # DOWNLOAD CHAPTERS    
-    for chapter in CHAPTERS:
+  return CHAPTERS, follow_state
+
+def download_and_convert(manga_service, args, cancelled=None) -> List[float]:
+  MANGA_DIR = strip_path(args.directory, DIRECTORY_KEEP)
+  directory = os.path.abspath(manga_directory(manga_service.current_manga.title))
+
+  CHAPTERS, follow_state = select_chapters(manga_service, args)
+  if not CHAPTERS:
+    return []
+
+  def download_chapter(chapter):
+    if cancelled is not None and cancelled():
+      error(f'Cancelled before chapter {chapter:g}')
+    if args.cache: # pages are reused as they are, they must match the hashes they were downloaded with
+      corrupted = PageManifest(chapter_directory(manga_service.current_manga.title, chapter)).corrupted()
+      if corrupted:
+        error(f"Chapter {chapter:g} has corrupted pages: {', '.join(corrupted)}", 'Download it again without --cache')
+    if not args.cache:
       print_colored(f'Downloading {manga_service.current_manga.title} {chapter:g}', Fore.YELLOW, Style.BRIGHT)
 
       manga_service.get_pages(chapter)
 
+  # DOWNLOAD CHAPTERS (every chapter is yielded to the conversion as soon as it is downloaded)
+  chapters = ChapterPipeline(download_chapter).run(CHAPTERS)
+
   extension = f'.{args.format.lower()}'
   args.format = args.format.upper()
 
@@ -144,7 +459,7 @@ if __name__ == "__main__":
 
     if args.format == 'PDF':
       chapters_paths = []
-      for chapter in CHAPTERS:
+      for chapter in chapters:
         chapter_dir = chapter_directory(manga_service.current_manga.title, chapter)
         page_number_paths = sorted(list(files(chapter_dir, 'png')), key=lambda page_path: int(page_path[0]))
         page_paths = list(map(lambda page_path: page_path[1], page_number_paths))
@@ -159,37 +474,135 @@ if __name__ == "__main__":
         convert_to_pdf(path, chapters_paths)
     else:
       # CONVERT TO E-READER FORMAT
-      from kindlecomicconverter.comic2ebook import main as manga2ebook
-
       argv = ['--output', MANGA_DIR, '-p', args.profile, '--manga-style', '--hq', '-f', args.format, '--batchsplit', single(args.single), '-u', '-r', split_rotate_2_pages(args.rotate)]
       
       if not args.fullsize:
         argv.append('-s')
 
+      conversion_cache = ConversionCache() # the same pages converted with the same options are not converted again
+
       if args.single:
+        for _ in chapters: # all chapters must be downloaded before packing them
+          pass
         chapter_interval = chapters_to_intervals_string(CHAPTERS)
-        with tempfile.TemporaryDirectory() as temp:
-          copy_all([(chapter, chapter_directory(manga_service.current_manga.title, chapter)) for chapter in CHAPTERS], temp)
-          title = f'{manga_service.current_manga.title} {chapter_interval}'
-          print_colored(title, Fore.BLUE)
-          argv = argv + ['--title', title, temp] # all chapters in manga directory are packed
-          cache_convert(argv)
-          path = f'{MANGA_DIR}/{manga_service.current_manga.title} {chapter_interval}{extension}'
-          os.rename(f'{MANGA_DIR}/{os.path.basename(temp)}{extension}', path)
+        title = f'{manga_service.current_manga.title} {chapter_interval}'
+        print_colored(title, Fore.BLUE)
+        path = f'{MANGA_DIR}/{manga_service.current_manga.title} {chapter_interval}{extension}'
+        pages = [page for chapter in CHAPTERS for page in ConversionCache.chapter_pages(chapter_directory(manga_service.current_manga.title, chapter))]
+        key = ConversionCache.key(pages, ConversionCache.kcc_options(argv, title))
+        if conversion_cache.get(key, extension, path):
+          METRICS.count('conversion_cache_total', result='hit', format=args.format)
+          print_colored(f'DONE: {os.path.abspath(path)} (converted before)', Fore.GREEN, Style.BRIGHT)
+        else:
+          METRICS.count('conversion_cache_total', result='miss', format=args.format)
+          with tempfile.TemporaryDirectory() as temp:
+            link_all([(chapter, chapter_directory(manga_service.current_manga.title, chapter)) for chapter in CHAPTERS], temp)
+            argv = argv + ['--title', title, temp] # all chapters in manga directory are packed
+            with METRICS.timer('stage_seconds', stage='convert'):
+              cache_convert(argv)
+            os.rename(f'{MANGA_DIR}/{os.path.basename(temp)}{extension}', path)
+          conversion_cache.put(key, extension, path)
           print_colored(f'DONE: {os.path.abspath(path)}', Fore.GREEN, Style.BRIGHT)
       else:
-        for chapter in CHAPTERS:
-          title = f'{manga_service.current_manga.title} {chapter:g}'
-          print_colored(title, Fore.BLUE)
-          argv_chapter = argv + ['--title', title, chapter_directory(manga_service.current_manga.title, chapter)]
-          cache_convert(argv_chapter)
-          path = f'{MANGA_DIR}/{manga_service.current_manga.title} {chapter:g}{extension}'
-          os.rename(f'{MANGA_DIR}/{chapter:g}{extension}', path)
-          print_colored(f'DONE: {os.path.abspath(path)}', Fore.GREEN, Style.BRIGHT)
+        # chapters are converted in parallel processes as soon as they are downloaded
+        with conversion_pool() as executor:
+          conversions = []
+          def print_done(wait=False):
+            while conversions and (wait or conversions[0].done()):
+              path, elapsed = conversions.pop(0).result()
+              if elapsed is None: # converted before
+                print_colored(f'DONE: {os.path.abspath(path)} (converted before)', Fore.GREEN, Style.BRIGHT)
+                continue
+              METRICS.observe('stage_seconds', elapsed, stage='convert') # measured in the conversion process
+              print_colored(f'DONE: {os.path.abspath(path)}', Fore.GREEN, Style.BRIGHT)
+          for chapter in chapters:
+            title = f'{manga_service.current_manga.title} {chapter:g}'
+            print_colored(title, Fore.BLUE)
+            chapter_dir = chapter_directory(manga_service.current_manga.title, chapter)
+            argv_chapter = argv + ['--title', title, chapter_dir]
+            path = f'{MANGA_DIR}/{manga_service.current_manga.title} {chapter:g}{extension}'
+            key = ConversionCache.key(ConversionCache.chapter_pages(chapter_dir), ConversionCache.kcc_options(argv, title))
+            if conversion_cache.get(key, extension, path):
+              METRICS.count('conversion_cache_total', result='hit', format=args.format)
+              converted = Future()
+              converted.set_result((path, None))
+              conversions.append(converted)
+            else:
+              METRICS.count('conversion_cache_total', result='miss', format=args.format)
+              conversions.append(executor.submit(convert_chapter, argv_chapter, f'{chapter:g}{extension}', path, key))
+            print_done()
+          print_done(wait=True)
   else:
+    for _ in chapters:
+      pass
     if len(CHAPTERS) == 1:
       directory = os.path.abspath(chapter_directory(manga_service.current_manga.title, CHAPTERS[0]))
       chapter_intervals_info = ''
     else:
       chapter_intervals_info = f" ({chapters_to_intervals_string(CHAPTERS, interval_sep=', ')})"
     print_colored(f'DONE: {directory}{chapter_intervals_info}', Fore.GREEN, Style.BRIGHT)
+
+  if args.follow: # chapters with missing pages are retried in the next run
+    complete = [chapter for chapter in CHAPTERS if args.cache or PageManifest(chapter_directory(manga_service.current_manga.title, chapter)).is_complete()]
+    follow_state.update(manga_service, complete)
+    follow_state.save()
+
+  return CHAPTERS
+
+if __name__ == "__main__":
+  cancellable()
+  freeze_support()
+  init_console_colors()
+  
+  # PARSE ARGS
+  ass = ArgsSingleService()
+  ass.args = set_args(CheckVersion)
+  args = ass.args
+  configure_metrics(args)
+  mark('arguments')
+
+  check_version_in_background()
+
+  if args.profile_startup:
+    report_startup()
+
+  if not args.profile:
+    args.profile = 'KPW'
+
+  if args.prune_blobs:
+    freed = BlobStore().prune()
+    print_colored(f'{freed / (1024 * 1024):.1f} MB freed', Fore.GREEN, Style.BRIGHT)
+    exit()
+
+  if args.batch:
+    batch(args.batch, args)
+    exit()
+
+  if args.serve is not None:
+    serve(args)
+    exit()
+
+  if args.worker:
+    shard_worker(args)
+    exit()
+
+  MANGA = ' '.join(args.manga)
+
+  manga_service = None
+  if args.cache: # offline search
+    manga_service = LocalManga()
+    manga_service.base_search(MANGA)
+    if not manga_service.search_results:
+      suggest_titles(MANGA)
+      exit()
+    manga_service = title_selection([manga_service], MANGA)
+  else: # online search
+    manga_services = create_manga_service_and_search_online(MANGA)
+    if not manga_services:
+      exit()
+    manga_service = title_selection(manga_services, MANGA)
+
+  if args.shard:
+    shard(manga_service, args)
+  else:
+    download_and_convert(manga_service, args)
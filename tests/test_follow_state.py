@@ -0,0 +1,57 @@
+from lib.ConcreteMangas.LocalManga import LocalManga
+from lib.FollowState import FollowState
+from lib.results.manga_class import Chapter, Manga
+
+class OnlineService:
+    def __init__(self, name, uuid, chapter_ids):
+        self.name = name
+        self.current_manga = Manga()
+        self.current_manga.uuid = uuid
+        self.current_manga.chapters = {}
+        for number, chapter_id in chapter_ids.items():
+            chapter = Chapter()
+            chapter.uuid = chapter_id
+            self.current_manga.chapters[number] = chapter
+
+def test_new_chapters_by_number(tmp_path):
+    service = OnlineService('InManga', 'series', { 1.0: 'a', 2.0: 'b', 2.5: 'c' })
+    state = FollowState(str(tmp_path))
+    assert state.new_chapters(service, [1.0, 2.0, 2.5]) == [1.0, 2.0, 2.5]
+    state.update(service, [1.0, 2.0])
+    assert state.new_chapters(service, [1.0, 2.0, 2.5]) == [2.5]
+
+def test_chapter_uploaded_again_is_new(tmp_path):
+    state = FollowState(str(tmp_path))
+    state.update(OnlineService('InManga', 'series', { 1.0: 'a', 2.0: 'b' }), [1.0, 2.0])
+    uploaded_again = OnlineService('InManga', 'series', { 1.0: 'a', 2.0: 'b2' })
+    assert state.new_chapters(uploaded_again, [1.0, 2.0]) == [2.0]
+
+def test_other_provider_or_series_is_not_followed(tmp_path):
+    state = FollowState(str(tmp_path))
+    service = OnlineService('InManga', 1234, { 1.0: 'a' })
+    assert state.follows(service)
+    state.update(service, [1.0])
+    assert state.follows(OnlineService('InManga', '1234', {}))
+    assert not state.follows(OnlineService('LectorManga', 1234, {}))
+    assert not state.follows(OnlineService('InManga', 'other', {}))
+    state.reset()
+    assert state.new_chapters(service, [1.0]) == [1.0]
+
+def test_local_update_keeps_the_online_state(tmp_path):
+    state = FollowState(str(tmp_path))
+    service = OnlineService('InManga', 'series', { 1.0: 'a' })
+    state.update(service, [1.0])
+    local = LocalManga()
+    assert state.follows(local)
+    assert state.new_chapters(local, [1.0, 2.0]) == [2.0]
+    state.update(local, [1.0, 2.0])
+    assert (state.provider, state.uuid) == ('InManga', 'series')
+    assert state.new_chapters(service, [1.0]) == []
+
+def test_saved_state_is_loaded(tmp_path):
+    state = FollowState(str(tmp_path / 'Title'))
+    state.update(OnlineService('InManga', 'series', { 1.0: 'a' }), [1.0])
+    state.save()
+    loaded = FollowState(str(tmp_path / 'Title'))
+    assert (loaded.provider, loaded.uuid, loaded.chapters) == ('InManga', 'series', { '1': 'a' })
+    assert loaded.updated == state.updated
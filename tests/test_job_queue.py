@@ -0,0 +1,53 @@
+import pytest
+
+from lib.JobQueue import CANCELLED, DONE, DOWNLOADED, DOWNLOADING, QUEUED, JobQueue
+
+@pytest.fixture
+def job_queue(tmp_path):
+    job_queue = JobQueue(str(tmp_path / 'jobs.sqlite'))
+    yield job_queue
+    job_queue.close()
+
+def test_identical_request_is_not_queued_twice(job_queue):
+    job, created = job_queue.submit({ 'title': 'One Piece', 'chapters': '1..3' })
+    duplicate, created_again = job_queue.submit({ 'title': '  one   PIECE ', 'chapters': '1..3' })
+    assert created and not created_again
+    assert duplicate['id'] == job['id']
+
+def test_other_options_are_another_job(job_queue):
+    job, _ = job_queue.submit({ 'title': 'One Piece', 'chapters': '1..3' })
+    other, created = job_queue.submit({ 'title': 'One Piece', 'chapters': '4..5' })
+    assert created and other['id'] != job['id']
+
+def test_finished_request_is_queued_again(job_queue):
+    job, _ = job_queue.submit({ 'title': 'One Piece' })
+    job_queue.update(job['id'], DONE)
+    again, created = job_queue.submit({ 'title': 'One Piece' })
+    assert created and again['id'] != job['id']
+
+def test_cancelled_request_is_queued_again(job_queue):
+    job, _ = job_queue.submit({ 'title': 'One Piece' })
+    assert job_queue.cancel(job['id'])['status'] == CANCELLED
+    again, created = job_queue.submit({ 'title': 'One Piece' })
+    assert created and again['id'] != job['id']
+
+def test_claim_oldest_job_once(job_queue):
+    first, _ = job_queue.submit({ 'title': 'One Piece' })
+    job_queue.submit({ 'title': 'Naruto' })
+    claimed = job_queue.claim(QUEUED, DOWNLOADING)
+    assert claimed['id'] == first['id'] and claimed['status'] == DOWNLOADING
+    assert job_queue.claim(QUEUED, DOWNLOADING)['request']['title'] == 'Naruto'
+    assert job_queue.claim(QUEUED, DOWNLOADING) is None
+
+def test_running_job_cancelled_ends_cancelled(job_queue):
+    job, _ = job_queue.submit({ 'title': 'One Piece' })
+    job_queue.claim(QUEUED, DOWNLOADING)
+    assert job_queue.cancel(job['id'])['status'] == DOWNLOADING # at the next chapter
+    assert job_queue.cancel_requested(job['id'])
+    assert job_queue.update(job['id'], DOWNLOADED, { 'chapters': [1] }) == CANCELLED
+
+def test_recover_interrupted_jobs(job_queue):
+    job, _ = job_queue.submit({ 'title': 'One Piece' })
+    job_queue.claim(QUEUED, DOWNLOADING)
+    assert job_queue.recover() == 1
+    assert job_queue.get(job['id'])['status'] == QUEUED
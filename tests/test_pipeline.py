@@ -0,0 +1,35 @@
+import threading
+
+import pytest
+
+from lib.Common import ErrorExit, error
+from lib.Pipeline import ChapterPipeline
+
+def test_chapters_are_yielded_in_order():
+    downloaded = []
+    pipeline = ChapterPipeline(downloaded.append, maxsize=1)
+    assert list(pipeline.run([1.0, 2.0, 3.0])) == [1.0, 2.0, 3.0]
+    assert downloaded == [1.0, 2.0, 3.0]
+
+def test_download_error_reaches_the_consumer():
+    def download(chapter):
+        if chapter == 2.0:
+            error('Chapter 2 not found')
+    pipeline = ChapterPipeline(download)
+    converted = []
+    with pytest.raises(ErrorExit):
+        for chapter in pipeline.run([1.0, 2.0, 3.0]):
+            converted.append(chapter)
+    assert converted == [1.0]
+
+def test_consumer_stopping_stops_the_downloads():
+    downloaded = []
+    pipeline = ChapterPipeline(downloaded.append, maxsize=1)
+    chapters = pipeline.run([float(chapter) for chapter in range(10)])
+    assert next(chapters) == 0.0
+    chapters.close()
+    for thread in threading.enumerate():
+        if thread is not threading.current_thread() and thread.daemon:
+            thread.join(timeout=5)
+    assert len(downloaded) < 10
+    assert not [thread for thread in threading.enumerate() if thread.daemon and thread.is_alive()]
@@ -0,0 +1,52 @@
+import time
+from email.utils import formatdate
+
+from lib.Constants import BACKOFF_BASE, BACKOFF_MAX
+from lib.RateLimiter import CircuitBreaker, TokenBucket, backoff, retry_after
+
+class Response:
+    def __init__(self, headers):
+        self.headers = headers
+
+def test_backoff_grows_up_to_the_maximum():
+    for attempt in range(3):
+        assert BACKOFF_BASE * 2 ** attempt / 2 <= backoff(attempt) <= BACKOFF_BASE * 2 ** attempt
+    assert BACKOFF_MAX / 2 <= backoff(50) <= BACKOFF_MAX
+
+def test_retry_after_seconds_and_date():
+    assert retry_after(Response({})) is None
+    assert retry_after(Response({ 'Retry-After': 'soon' })) is None
+    assert retry_after(Response({ 'Retry-After': '30' })) == 30
+    assert retry_after(Response({ 'Retry-After': '100000' })) == BACKOFF_MAX
+    assert 25 < retry_after(Response({ 'Retry-After': formatdate(time.time() + 30, usegmt=True) })) <= 30
+
+def test_throttled_bucket_slows_down_and_recovers():
+    bucket = TokenBucket(rate=10, burst=2, min_rate=1)
+    bucket.throttled()
+    bucket.throttled()
+    bucket.throttled()
+    bucket.throttled()
+    assert bucket.rate == 1 and bucket.tokens <= 0
+    for _ in range(100):
+        bucket.succeeded()
+    assert bucket.rate == 10
+
+def test_throttled_bucket_waits_retry_after():
+    bucket = TokenBucket(rate=1000, burst=1)
+    bucket.throttled(wait=0.1)
+    start = time.monotonic()
+    bucket.acquire()
+    assert time.monotonic() - start >= 0.1
+
+def test_circuit_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(threshold=3, cooldown=60)
+    breaker.record(False)
+    breaker.record(False)
+    breaker.record(True)
+    breaker.record(False)
+    breaker.record(False)
+    assert breaker.remaining() == 0
+    breaker.record(False)
+    assert 59 < breaker.remaining() <= 60
+    breaker.record(True)
+    assert breaker.remaining() == 0
@@ -0,0 +1,59 @@
+import time
+
+import pytest
+
+from lib.ResponseCache import CachedResponse, ResponseCache
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResponseCache(str(tmp_path / 'responses'))
+
+def response(content=b'body', headers=None):
+    return CachedResponse('https://provider/search', 200, content, headers)
+
+def test_key_depends_on_the_request():
+    key = ResponseCache.key('InManga', 'get', 'https://provider/search', { 'title': 'One Piece' })
+    assert key == ResponseCache.key('InManga', 'GET', 'https://provider/search', { 'title': 'One Piece' })
+    assert key != ResponseCache.key('InManga', 'GET', 'https://provider/search', { 'title': 'Naruto' })
+    assert key != ResponseCache.key('LectorManga', 'GET', 'https://provider/search', { 'title': 'One Piece' })
+
+def test_stored_response(cache):
+    assert cache.get('key') == (None, None)
+    cache.put('key', response(b'results'))
+    meta, cached = cache.get('key')
+    assert cached.content == b'results' and cached.status_code == 200 and cached.url == 'https://provider/search'
+
+def test_ttl(cache):
+    cache.put('key', response())
+    meta, _ = cache.get('key')
+    assert ResponseCache.is_fresh(meta, ttl=60)
+    meta['stored'] -= 61
+    assert not ResponseCache.is_fresh(meta, ttl=60)
+
+def test_revalidated_starts_the_ttl_again(cache):
+    cache.put('key', response())
+    meta, _ = cache.get('key')
+    meta['stored'] -= 61
+    cache._write_meta('key', meta)
+    assert not ResponseCache.is_fresh(cache.get('key')[0], ttl=60)
+    cache.revalidated('key')
+    assert ResponseCache.is_fresh(cache.get('key')[0], ttl=60)
+
+def test_validators_from_etag_and_last_modified(cache):
+    cache.put('key', response(headers={ 'ETag': '"v1"', 'Last-Modified': 'Tue, 01 Nov 2022 10:00:00 GMT', 'Set-Cookie': 'a=b' }))
+    meta, _ = cache.get('key')
+    assert ResponseCache.validators(meta) == { 'If-None-Match': '"v1"', 'If-Modified-Since': 'Tue, 01 Nov 2022 10:00:00 GMT' }
+    cache.put('other', response())
+    assert ResponseCache.validators(cache.get('other')[0]) == {}
+
+def test_least_recently_used_are_evicted(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'responses'), max_size=10)
+    cache.put('old', response(b'12345'))
+    time.sleep(0.01)
+    cache.put('recent', response(b'12345'))
+    time.sleep(0.01)
+    cache.get('old') # used again
+    time.sleep(0.01)
+    cache.put('new', response(b'12345'))
+    assert cache.get('recent') == (None, None)
+    assert cache.get('old')[1].content == b'12345' and cache.get('new')[1].content == b'12345'
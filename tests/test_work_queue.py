@@ -0,0 +1,83 @@
+import time
+
+import pytest
+
+from lib.WorkQueue import DONE, FAILED, PENDING, WorkQueue
+
+LEASE = 0.05 # seconds, expired after sleeping EXPIRE
+EXPIRE = 0.1
+
+@pytest.fixture
+def work_queue(tmp_path):
+    work_queue = WorkQueue(str(tmp_path / 'shards.sqlite'), lease_seconds=LEASE, attempts=2)
+    yield work_queue
+    work_queue.close()
+
+def test_lease_hands_out_every_chapter_once(work_queue):
+    work_queue.add('InManga', 'id', 'Title', [1.0, 2.0])
+    first, second = work_queue.lease('a'), work_queue.lease('b')
+    assert {first['chapter'], second['chapter']} == {1.0, 2.0}
+    assert work_queue.lease('c') is None
+
+def test_expired_lease_is_handed_out_again(work_queue):
+    work_queue.add('InManga', 'id', 'Title', [1.0])
+    unit = work_queue.lease('a')
+    time.sleep(EXPIRE)
+    again = work_queue.lease('b')
+    assert again['id'] == unit['id'] and again['worker'] == 'b'
+    assert work_queue.finish(unit) is None # the lease was lost
+    assert work_queue.finish(again) == DONE
+
+def test_renewed_lease_is_kept(work_queue):
+    work_queue.add('InManga', 'id', 'Title', [1.0])
+    unit = work_queue.lease('a')
+    for _ in range(3):
+        time.sleep(LEASE / 2)
+        assert work_queue.renew(unit)
+    assert work_queue.lease('b') is None
+
+def test_expired_lease_without_attempts_left_fails(work_queue):
+    work_queue.add('InManga', 'id', 'Title', [1.0])
+    for worker in ('a', 'b'): # both crash while downloading it
+        assert work_queue.lease(worker) is not None
+        time.sleep(EXPIRE)
+    assert work_queue.lease('c') is None
+    assert work_queue.progress('InManga', 'id')[FAILED] == 1
+
+def test_failed_chapter_is_retried_until_attempts_run_out(work_queue):
+    work_queue.add('InManga', 'id', 'Title', [1.0])
+    assert work_queue.finish(work_queue.lease('a'), 'error') == PENDING
+    assert work_queue.finish(work_queue.lease('a'), 'error') == FAILED
+    assert [tuple(row) for row in work_queue.failed('InManga', 'id')] == [(1.0, 'error')]
+
+def test_finish_twice_is_ignored(work_queue):
+    work_queue.add('InManga', 'id', 'Title', [1.0])
+    unit = work_queue.lease('a')
+    assert work_queue.finish(unit) == DONE
+    assert work_queue.finish(unit, 'error') is None
+    assert work_queue.progress('InManga', 'id')[DONE] == 1
+
+def test_leased_is_lost_when_the_chapter_is_taken(work_queue):
+    work_queue.add('InManga', 'id', 'Title', [1.0])
+    unit = work_queue.lease('a')
+    with work_queue.leased(unit) as lost:
+        time.sleep(EXPIRE) # renewed in the background
+        assert not lost.is_set()
+        work_queue.connection.execute("UPDATE units SET worker = 'b'") # another worker took it
+        time.sleep(EXPIRE)
+        assert lost.is_set()
+
+def test_progress_of_the_given_chapters(work_queue):
+    work_queue.add('InManga', 'id', 'Title', [1.0, 2.0])
+    work_queue.finish(work_queue.lease('a'))
+    work_queue.finish(work_queue.lease('a'))
+    work_queue.add('InManga', 'id', 'Title', [3.0]) # a later run
+    assert work_queue.progress('InManga', 'id', [3.0]) == { PENDING: 1, 'leased': 0, DONE: 0, FAILED: 0 }
+    assert work_queue.progress('InManga', 'id')[DONE] == 2
+
+def test_add_queues_finished_chapters_again(work_queue):
+    work_queue.add('InManga', 'id', 'Title', [1.0])
+    work_queue.finish(work_queue.lease('a'))
+    work_queue.add('InManga', 'id', 'Title', [1.0])
+    unit = work_queue.lease('a')
+    assert unit is not None and unit['attempts'] == 0